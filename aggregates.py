@@ -0,0 +1,268 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from paths import CACHE_DIR
+from periods import WINDOW, growth, periods_for
+from statement import KEY_LINES, load_statement
+
+# Saved running totals for each peer group
+AGGREGATE_DIR = os.environ.get("AGGREGATE_DIR", os.path.join(CACHE_DIR, "aggregates"))
+
+AGGREGATE_METRICS = [
+    "Total Income",
+    "Quarterly Total Income Growth",
+    "Gross Margin",
+    "Total Expenses Ratio",
+    "Net Profit Margin",
+    "Total Cost Of Goods Sold % of Total Income",
+]
+YEAR = "Year"
+# Bump when the saved state layout changes
+AGGREGATE_VERSION = 2
+
+
+def file_fingerprint(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def file_stat(path):
+    # (mtime_ns, size); files are only hashed again when this changes
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def peer_metrics(values, months):
+    # metrics x periods for one peer, and its Periods; periods are the complete quarters
+    # plus the trailing twelve months (the full year for one-year statements)
+    periods = periods_for(months)
+    quarterly = periods.quarterly(values)
+    totals = np.concatenate([quarterly, periods.window(values)[:, np.newaxis]], axis=1)
+    income = totals[0]
+    quarter_growth = growth(quarterly[0], 1)
+    window_growth = quarter_growth[periods.window_quarters[1:]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        table = np.vstack([
+            income,
+            np.append(quarter_growth, window_growth.mean() if len(window_growth) else np.nan),
+            totals[2] / income * 100,
+            -totals[3] / income * 100,
+            totals[4] / income * 100,
+            -totals[1] / income * 100,
+        ])
+    return table, periods
+
+
+def window_of(first, last):
+    # Trailing window (first, last month) of a contiguous month range
+    first, last = np.datetime64(first, "M"), np.datetime64(last, "M")
+    return max(first, last - (WINDOW - 1)), last
+
+
+class IndustryAggregate:
+    # Running sums per metric and period for a peer group. Peers may cover different
+    # months: the quarter columns are the union of the peers' quarters, and like
+    # financial_analysis.calculate_industry_averages the YEAR column only counts peers
+    # that cover the group's trailing window.
+    def __init__(self, group, directory=AGGREGATE_DIR):
+        self.group = group
+        self.path = os.path.join(directory, f"{group}.json")
+        self.periods = None
+        self.keys = []
+        self.peers = {}
+        self.sums = self.sumsq = self.counts = None
+
+    @classmethod
+    def load(cls, group, directory=AGGREGATE_DIR):
+        aggregate = cls(group, directory)
+        if os.path.exists(aggregate.path):
+            with open(aggregate.path) as f:
+                state = json.load(f)
+            # Older layouts are rebuilt from the statements by the next sync
+            if not state["peers"] or state.get("version") != AGGREGATE_VERSION:
+                return aggregate
+            aggregate.periods = state["periods"]
+            aggregate.keys = state["keys"]
+            aggregate.peers = state["peers"]
+            aggregate.sums = np.array(state["sums"], dtype="float64")
+            aggregate.sumsq = np.array(state["sumsq"], dtype="float64")
+            aggregate.counts = np.array(state["counts"], dtype="int64")
+        return aggregate
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        state = {
+            "version": AGGREGATE_VERSION,
+            "group": self.group,
+            "metrics": AGGREGATE_METRICS,
+            "periods": self.periods,
+            "keys": self.keys,
+            "peers": self.peers,
+            "sums": None if self.sums is None else self.sums.tolist(),
+            "sumsq": None if self.sumsq is None else self.sumsq.tolist(),
+            "counts": None if self.counts is None else self.counts.tolist(),
+        }
+        # A private temporary file per writer; concurrent saves each replace the file whole
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+    def __len__(self):
+        return len(self.peers)
+
+    def window(self, peers=None):
+        # The group's trailing window over the union of the peers' months, or None
+        spans = [peer["span"] for peer in (self.peers.values() if peers is None else peers)]
+        if not spans:
+            return None
+        return window_of(min(np.datetime64(first, "M") for first, _ in spans), max(np.datetime64(last, "M") for _, last in spans))
+
+    def _expand(self, keys, labels):
+        # Adds quarter columns for keys the group does not cover yet, keeping quarters in order
+        if self.sums is None:
+            self.keys, self.periods = [], [YEAR]
+            self.sums = np.zeros((len(AGGREGATE_METRICS), 1))
+            self.sumsq = np.zeros((len(AGGREGATE_METRICS), 1))
+            self.counts = np.zeros((len(AGGREGATE_METRICS), 1), dtype="int64")
+        names = dict(zip(self.keys, self.periods[:-1]))
+        names.update(zip(keys, labels))
+        merged = sorted(names)
+        if merged == self.keys:
+            return
+        columns = [merged.index(key) for key in self.keys] + [len(merged)]
+        for name in ("sums", "sumsq", "counts"):
+            old = getattr(self, name)
+            grown = np.zeros((old.shape[0], len(merged) + 1), dtype=old.dtype)
+            grown[:, columns] = old
+            setattr(self, name, grown)
+        self.keys = merged
+        self.periods = [names[key] for key in merged] + [YEAR]
+
+    def _table(self, peer, window):
+        # A peer's metrics on the group's columns; NaN where the peer has no data
+        stored = np.array(peer["metrics"], dtype="float64")
+        table = np.full((len(AGGREGATE_METRICS), len(self.periods)), np.nan)
+        table[:, [self.keys.index(key) for key in peer["quarter_keys"]]] = stored[:, :-1]
+        if window_of(*peer["span"]) == window:
+            table[:, -1] = stored[:, -1]
+        return table
+
+    def _apply(self, table, sign):
+        present = ~np.isnan(table)
+        filled = np.where(present, table, 0.0)
+        self.sums += sign * filled
+        self.sumsq += sign * filled ** 2
+        self.counts += sign * present
+
+    def _reset_year(self, window):
+        # The window moved, so the YEAR column is recounted from the stored peer metrics
+        self.sums[:, -1] = self.sumsq[:, -1] = 0.0
+        self.counts[:, -1] = 0
+        for peer in self.peers.values():
+            year = self._table(peer, window)[:, -1:]
+            present = ~np.isnan(year)
+            self.sums[:, -1:] += np.where(present, year, 0.0)
+            self.sumsq[:, -1:] += np.where(present, year, 0.0) ** 2
+            self.counts[:, -1:] += present
+
+    def add(self, peer_id, statement_path):
+        # Adds a peer, or replaces it if it is already in the group
+        statement = load_statement(statement_path)
+        table, periods = peer_metrics(statement.lines(KEY_LINES), statement.months)
+        if peer_id in self.peers:
+            self.remove(peer_id)
+        peer = {
+            "path": statement_path,
+            "fingerprint": file_fingerprint(statement_path),
+            "stat": file_stat(statement_path),
+            "metrics": np.where(np.isnan(table), None, table).tolist(),
+            "quarter_keys": periods.quarter_keys.tolist(),
+            "span": [str(periods.grid[0]), str(periods.grid[-1])],
+        }
+        window = self.window([*self.peers.values(), peer])
+        self._expand(peer["quarter_keys"], periods.quarters)
+        if window != self.window():
+            self._reset_year(window)
+        self.peers[peer_id] = peer
+        self._apply(self._table(peer, window), 1)
+
+    def remove(self, peer_id):
+        window = self.window()
+        peer = self.peers.pop(peer_id)
+        self._apply(self._table(peer, window), -1)
+        if not self.peers:
+            self.periods, self.keys = None, []
+            self.sums = self.sumsq = self.counts = None
+            return
+        # Quarters no remaining peer covers are dropped
+        covered = {key for other in self.peers.values() for key in other["quarter_keys"]}
+        keep = [i for i, key in enumerate(self.keys) if key in covered] + [len(self.keys)]
+        if len(keep) <= len(self.keys):
+            self.sums, self.sumsq, self.counts = self.sums[:, keep], self.sumsq[:, keep], self.counts[:, keep]
+            self.keys = [self.keys[i] for i in keep[:-1]]
+            self.periods = [self.periods[i] for i in keep]
+        if self.window() != window:
+            self._reset_year(self.window())
+
+    def sync(self, statement_paths):
+        # Brings the group in line with a list of files, touching only what changed
+        wanted = {os.path.splitext(os.path.basename(path))[0]: path for path in statement_paths}
+        changed = False
+        for peer_id in [peer_id for peer_id in self.peers if peer_id not in wanted]:
+            self.remove(peer_id)
+            changed = True
+        for peer_id, path in wanted.items():
+            peer = self.peers.get(peer_id)
+            if peer is not None and peer["path"] == path and peer.get("stat") == file_stat(path):
+                continue
+            if peer is None or peer["fingerprint"] != file_fingerprint(path):
+                self.add(peer_id, path)
+            else:
+                # Touched or moved but unchanged: only the remembered stat is updated
+                peer["path"], peer["stat"] = path, file_stat(path)
+            changed = True
+        return changed
+
+    def _cell(self, metric, period):
+        return AGGREGATE_METRICS.index(metric), self.periods.index(period)
+
+    def mean(self, metric, period=YEAR):
+        i, j = self._cell(metric, period)
+        return self.sums[i, j] / self.counts[i, j] if self.counts[i, j] else float("nan")
+
+    def std(self, metric, period=YEAR):
+        i, j = self._cell(metric, period)
+        count = self.counts[i, j]
+        if not count:
+            return float("nan")
+        mean = self.sums[i, j] / count
+        return float(np.sqrt(max(self.sumsq[i, j] / count - mean ** 2, 0.0)))
+
+    def averages(self):
+        # Same shape as financial_analysis.calculate_industry_averages
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.sums / self.counts
+        return {
+            "quarterly_income": pd.DataFrame({"Industry Average": means[0, :-1]}, index=self.periods[:-1]),
+            "metrics": pd.DataFrame({"Industry Average": means[1:, -1]}, index=AGGREGATE_METRICS[1:]),
+        }
+
+
+def load_group(group, statement_paths, directory=AGGREGATE_DIR):
+    # Loads the saved state for a group and updates it for any changed files
+    aggregate = IndustryAggregate.load(group, directory)
+    if aggregate.sync(statement_paths):
+        aggregate.save()
+    return aggregate
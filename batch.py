@@ -0,0 +1,175 @@
+import argparse
+import functools
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import financial_analysis as fa
+
+
+def find_statements(inputs):
+    # Accepts directories, glob patterns and plain file paths
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "*.csv"))))
+        else:
+            paths.extend(sorted(glob.glob(item)))
+    return list(dict.fromkeys(paths))
+
+
+def checkpoint_path(output_dir, company_id):
+    return os.path.join(output_dir, f"{company_id}.json")
+
+
+def checkpoint_done(path, use_llm):
+    # A checkpoint only counts when it holds the stages this run asks for; runs with
+    # --no-llm leave checkpoints without the market report and analysis
+    try:
+        with open(path) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return not use_llm or result.get("llm", "analysis" in result)
+
+
+def write_checkpoint(path, result):
+    # Write to a temporary file first so an interrupted run never leaves partial JSON
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compute_offline(statement_path):
+    # CPU stage: runs in a worker process
+    lines, months = fa.load_key_lines(statement_path)
+    result = fa.compute_financial_metrics(lines[None], months)
+    summary, tokens = fa.build_statement_summary(statement_path)
+    return {
+        "quarterly_income": dict(zip(result["quarters"], result["quarterly_income"][0].tolist())),
+        "metrics": dict(zip(fa.METRIC_NAMES, result["metrics"][0].tolist())),
+        "summary": summary,
+        "summary_tokens": tokens,
+    }
+
+
+def run_llm_stages(company_name, statement_path, peers, company_statement=None):
+    # Network stage: runs in a worker thread; the summary comes from the CPU stage
+    if callable(peers):
+        peers = peers(statement_path)
+    results = fa.run_analysis(company_name, statement_path=statement_path, peers=peers, company_statement=company_statement)
+    return {
+        "market_report": results["market_report"],
+        "industry_averages": results["industry_averages"],
+        "analysis": results["analysis"],
+    }
+
+
+def run_batch(statements, peers, output_dir, names=None, cpu_workers=None, network_workers=4, use_llm=True):
+    names = names or {}
+    os.makedirs(output_dir, exist_ok=True)
+    todo = []
+    for path in statements:
+        company_id = os.path.splitext(os.path.basename(path))[0]
+        if checkpoint_done(checkpoint_path(output_dir, company_id), use_llm):
+            continue
+        todo.append((company_id, path))
+    skipped = len(statements) - len(todo)
+    if skipped:
+        print(f"Resuming: {skipped} companies already done", file=sys.stderr)
+
+    started = time.monotonic()
+    completed = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, ThreadPoolExecutor(max_workers=network_workers) as network_pool:
+        offline = {cpu_pool.submit(compute_offline, path): (company_id, path) for company_id, path in todo}
+        online = {}
+        for future in as_completed(offline):
+            company_id, path = offline[future]
+            try:
+                result = {"company": names.get(company_id, company_id), "statement": path, "llm": use_llm, **future.result()}
+            except Exception as exc:
+                failed += 1
+                print(f"{company_id}: failed to parse statement: {exc}", file=sys.stderr)
+                continue
+            if use_llm:
+                online[network_pool.submit(run_llm_stages, result["company"], path, peers, result["summary"])] = (company_id, result)
+            else:
+                write_checkpoint(checkpoint_path(output_dir, company_id), result)
+                completed += 1
+
+        for future in as_completed(online):
+            company_id, result = online[future]
+            try:
+                result.update(future.result())
+            except Exception as exc:
+                failed += 1
+                print(f"{company_id}: analysis failed: {exc}", file=sys.stderr)
+                continue
+            write_checkpoint(checkpoint_path(output_dir, company_id), result)
+            completed += 1
+            elapsed = time.monotonic() - started
+            print(f"{company_id}: done ({completed}/{len(todo)}, {completed / elapsed * 60:.1f} companies/min)", file=sys.stderr)
+
+    elapsed = time.monotonic() - started
+    return {
+        "completed": completed,
+        "failed": failed,
+        "skipped": skipped,
+        "seconds": elapsed,
+        "companies_per_minute": completed / elapsed * 60 if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze many company statements without the Streamlit UI.")
+    parser.add_argument("inputs", nargs="+", help="statement CSVs, directories or glob patterns")
+    parser.add_argument("--peers", nargs="+", default=fa.PEER_FILES, help="peer statements used for industry averages")
+    parser.add_argument("--peer-store", help="use peers from this columnar peer store instead of --peers")
+    parser.add_argument("--peer-companies", nargs="+", help="companies to use from --peer-store (default: all)")
+    parser.add_argument("--peer-year", type=int, help="fiscal year to use from --peer-store")
+    parser.add_argument("--auto-peers", type=int, metavar="K", help="benchmark each company against its K most similar input statements")
+    parser.add_argument("--peer-group", help="keep running industry aggregates for --peers under this name")
+    parser.add_argument("--output", default="results", help="directory for per-company JSON checkpoints")
+    parser.add_argument("--names", help="JSON file mapping statement file names (without .csv) to company names")
+    parser.add_argument("--cpu-workers", type=int, default=os.cpu_count(), help="processes for parsing and metrics")
+    parser.add_argument("--network-workers", type=int, default=4, help="threads for Perplexity and Groq calls")
+    parser.add_argument("--no-llm", action="store_true", help="only compute the deterministic metrics")
+    args = parser.parse_args(argv)
+
+    names = {}
+    if args.names:
+        with open(args.names) as f:
+            names = json.load(f)
+
+    statements = find_statements(args.inputs)
+    if not statements:
+        parser.error("no statement CSVs found")
+    peers = args.peers
+    if args.auto_peers:
+        from peer_index import select_peers
+        peers = functools.partial(select_peers, candidates=statements, k=args.auto_peers)
+    elif args.peer_store:
+        from peer_store import PeerQuery
+        peers = PeerQuery(args.peer_store, companies=args.peer_companies, year=args.peer_year)
+    elif args.peer_group:
+        from aggregates import load_group
+        peers = load_group(args.peer_group, args.peers)
+    stats = run_batch(
+        statements,
+        peers,
+        args.output,
+        names=names,
+        cpu_workers=args.cpu_workers,
+        network_workers=args.network_workers,
+        use_llm=not args.no_llm,
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
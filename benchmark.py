@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from paths import STATEMENT_PATH
+
+STAGES = ["market_report", "industry_averages", "analysis", "visualizations"]
+WORDS = ("revenue margin growth channel retail brand pricing demand supply cost "
+         "expansion market share distribution outlook consumer product").split()
+
+
+class StubLLMServer:
+    # Local stand-in for the Perplexity and Groq chat completion endpoints
+    def __init__(self, latency=0.2, token_rate=400.0, completion_tokens=300, failure_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _roll(self):
+        with self.lock:
+            self.requests += 1
+            roll = self.random.random()
+            if roll < self.failure_rate + self.rate_limit_rate:
+                self.failures += 1
+            return roll
+
+    def completion_text(self, max_tokens):
+        count = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        words = [WORDS[i % len(WORDS)] for i in range(count)]
+        return "<think>working through the numbers</think>" + " ".join(words)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                roll = stub._roll()
+                time.sleep(stub.latency)
+                if roll < stub.rate_limit_rate:
+                    self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "1"})
+                    return
+                if roll < stub.rate_limit_rate + stub.failure_rate:
+                    self._send_json(500, {"error": {"message": "injected failure"}})
+                    return
+
+                text = stub.completion_text(request.get("max_tokens"))
+                tokens = text.split(" ")
+                base = {"id": "stub", "created": int(time.time()), "model": request.get("model", "stub")}
+                if request.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for i, token in enumerate(tokens):
+                        chunk = {**base, "object": "chat.completion.chunk", "choices": [
+                            {"index": 0, "delta": {"content": token if i == 0 else " " + token}, "finish_reason": None}
+                        ]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(1 / stub.token_rate)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.close_connection = True
+                    return
+
+                time.sleep(len(tokens) / stub.token_rate)
+                prompt_chars = sum(len(m.get("content", "")) for m in request.get("messages", []))
+                self._send_json(200, {**base, "object": "chat.completion", "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                ], "usage": {
+                    "prompt_tokens": prompt_chars // 4,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_chars // 4 + len(tokens),
+                }})
+
+        return Handler
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def run_session(fa, session, iterations, peers, timings, errors, lock):
+    for iteration in range(iterations):
+        # A distinct company per iteration keeps the cache from short-circuiting calls
+        company_name = f"Benchmark Co {session}-{iteration}"
+        stages = [
+            ("market_report", lambda: fa.generate_market_report_perplexity(company_name)),
+            ("industry_averages", lambda: fa.calculate_averages_using_ai(peers, company_name)),
+            ("analysis", lambda: fa.analyze_company_standing(
+                fa.build_statement_summary(STATEMENT_PATH)[0], results["industry_averages"],
+                results["market_report"], company_name
+            )),
+            ("visualizations", lambda: fa.generate_visualizations(peers=peers)),
+        ]
+        results = {}
+        for stage, func in stages:
+            started = time.perf_counter()
+            try:
+                results[stage] = func()
+            except Exception as exc:
+                with lock:
+                    errors.append({"stage": stage, "error": repr(exc)})
+                break
+            with lock:
+                timings[stage].append(time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline against a local stub LLM server.")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="analyses per session")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub time to first byte in seconds")
+    parser.add_argument("--token-rate", type=float, default=400.0, help="stub completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="stub completion length")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of stub requests that return 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of stub requests that return 429")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    with StubLLMServer(args.latency, args.token_rate, args.completion_tokens, args.failure_rate, args.rate_limit_rate) as stub:
+        # Point the clients at the stub before financial_analysis builds them
+        cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+        os.environ["PERPLEXITY_API_URL"] = f"{stub.url}/chat/completions"
+        os.environ["GROQ_BASE_URL"] = stub.url
+        os.environ.setdefault("GROQ_API_KEY", "benchmark")
+        os.environ.setdefault("PERPLEXITY_API_KEY", "benchmark")
+        os.environ["LLM_CACHE_PATH"] = os.path.join(cache_dir, "responses.sqlite3")
+        if not args.cache:
+            os.environ["LLM_CACHE_TTL"] = "0"
+        import financial_analysis as fa
+
+        peers = fa.PEER_FILES
+        timings = {stage: [] for stage in STAGES}
+        errors = []
+        lock = threading.Lock()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            for session in range(args.sessions):
+                pool.submit(run_session, fa, session, args.iterations, peers, timings, errors, lock)
+        elapsed = time.perf_counter() - started
+        upstream_requests = stub.requests
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "wall_seconds": elapsed,
+        "sessions_completed": len(timings["visualizations"]),
+        "upstream_requests": upstream_requests,
+        "requests_per_second": upstream_requests / elapsed if elapsed else None,
+        "analyses_per_second": len(timings["visualizations"]) / elapsed if elapsed else None,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50_seconds": percentile(values, 50),
+                "p95_seconds": percentile(values, 95),
+            }
+            for stage, values in timings.items()
+        },
+        "errors": errors,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["stages"], indent=2))
+    print(f"{report['requests_per_second']:.1f} upstream requests/s, peak RSS {report['peak_rss_mb']:.0f} MB -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from peer_index import CHANNELS, channel_sales
+from periods import periods_for
+from statement import KEY_LINES, load_statement
+
+COMPANY = "Company"
+PEERS = "Peer Average"
+# Expense categories shown on their own; smaller ones are grouped as "Other"
+EXPENSE_CATEGORIES = 6
+COLORS = {COMPANY: "#6bc72e", PEERS: "#7f7f7f"}
+
+
+def expense_categories(statement):
+    # Operating expenses by category (third segment of the account name), categories x months
+    accounts = [account for account in statement.accounts if account.name.startswith("Expense.Expense.")]
+    names = [account.name.split(".")[2] for account in accounts]
+    categories = sorted(set(names))
+    totals = np.zeros((len(categories), len(statement.months)))
+    # Amounts booked directly on each account, so parents and children are not counted twice
+    np.add.at(
+        totals,
+        [categories.index(name) for name in names],
+        statement.own_values[:, [account.column for account in accounts]].T,
+    )
+    return categories, -totals
+
+
+@functools.lru_cache(maxsize=256)
+def _series(path, mtime_ns, size):
+    statement = load_statement(path)
+    periods = periods_for(statement.months)
+    lines = statement.lines(KEY_LINES)
+    categories, expenses = expense_categories(statement)
+    return {
+        "periods": periods,
+        "months": statement.months,
+        "lines": lines,
+        # Trailing-twelve-month totals behind the mix charts
+        "window_income": periods.window(lines[0]),
+        "channels": periods.window(channel_sales(statement)),
+        "expense_categories": categories,
+        "expenses": periods.window(expenses),
+    }
+
+
+def statement_series(path):
+    # Period sums for one statement, computed once per file version
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _series(path, stat.st_mtime_ns, stat.st_size)
+
+
+def peer_paths(peers):
+    # Statement files behind a peer set, or None when only the key lines are available
+    if hasattr(peers, "peers"):  # aggregates.IndustryAggregate
+        return [peer["path"] for peer in peers.peers.values()]
+    if hasattr(peers, "lines"):  # peer_store.PeerQuery
+        return None
+    return list(peers)
+
+
+def _margins(quarterly):
+    # KEY_LINES x quarters (or peers x KEY_LINES x quarters) to gross and net margin in percent
+    income = quarterly[..., 0, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return quarterly[..., 2, :] / income * 100, quarterly[..., 4, :] / income * 100
+
+
+def _shares(values, total):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return values / total * 100
+
+
+def _peer_mean(values):
+    # Mean over peers, skipping peers without data for a period
+    counts = (~np.isnan(values)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(values, axis=0) / counts
+
+
+@instrumented("chart_data")
+def chart_data(statement_path, peers):
+    # Small DataFrames behind every chart; cheap to store and to re-plot
+    company = statement_series(statement_path)
+    periods = company["periods"]
+    paths = peer_paths(peers)
+    if paths is None:
+        values, labels = peers.lines(KEY_LINES)
+        peer_lines = periods.align(values, labels)
+        peer_series = []
+    else:
+        # Peers are matched to the company's months, whatever range they cover
+        peer_series = [statement_series(path) for path in paths]
+        peer_lines = np.stack([periods.align(series["lines"], series["months"]) for series in peer_series])
+
+    gross, net = _margins(periods.quarterly(company["lines"]))
+    peer_gross, peer_net = _margins(periods.quarterly(peer_lines))
+    margins = pd.DataFrame({
+        f"{COMPANY} Gross Margin": gross,
+        f"{PEERS} Gross Margin": _peer_mean(peer_gross),
+        f"{COMPANY} Net Margin": net,
+        f"{PEERS} Net Margin": _peer_mean(peer_net),
+    }, index=periods.quarters)
+
+    revenue = pd.DataFrame({
+        COMPANY: periods.to_grid(company["lines"][0]),
+        PEERS: _peer_mean(peer_lines[:, 0]),
+    }, index=periods.grid_labels)
+
+    # Trailing-twelve-month mixes: expense categories as % of income, channels as % of product sales
+    expense_mix = pd.DataFrame(
+        {COMPANY: _shares(company["expenses"], company["window_income"])},
+        index=company["expense_categories"],
+    )
+    channels = pd.DataFrame({COMPANY: _shares(company["channels"], company["channels"].sum())}, index=list(CHANNELS))
+    if peer_series:
+        peer_mix = [
+            pd.Series(_shares(series["expenses"], series["window_income"]), index=series["expense_categories"])
+            for series in peer_series
+        ]
+        expense_mix[PEERS] = pd.concat(peer_mix, axis=1).fillna(0.0).mean(axis=1).reindex(expense_mix.index).fillna(0.0)
+        peer_channels = np.stack([series["channels"] for series in peer_series])
+        channels[PEERS] = _peer_mean(_shares(peer_channels, peer_channels.sum(axis=1, keepdims=True)))
+    else:
+        expense_mix[PEERS] = np.nan
+        channels[PEERS] = np.nan
+    expense_mix = expense_mix.sort_values(COMPANY, ascending=False)
+    if len(expense_mix) > EXPENSE_CATEGORIES:
+        other = expense_mix.iloc[EXPENSE_CATEGORIES:].sum(min_count=1).rename("Other")
+        expense_mix = pd.concat([expense_mix.iloc[:EXPENSE_CATEGORIES], other.to_frame().T])
+
+    return {"revenue": revenue, "margins": margins, "expense_mix": expense_mix, "channels": channels}
+
+
+def _layout(fig, title, yaxis_title):
+    fig.update_layout(
+        title=title,
+        yaxis_title=yaxis_title,
+        template="plotly_white",
+        legend={"orientation": "h", "y": -0.2},
+        margin={"l": 40, "r": 20, "t": 50, "b": 40},
+        height=400,
+    )
+    return fig
+
+
+def revenue_chart(data):
+    import plotly.graph_objects as go
+
+    revenue = data["revenue"]
+    fig = go.Figure([
+        go.Scatter(x=revenue.index, y=revenue[column], name=column, mode="lines+markers",
+                   line={"color": COLORS[column], "dash": "solid" if column == COMPANY else "dash"})
+        for column in (COMPANY, PEERS)
+    ])
+    fig.update_yaxes(tickprefix="$", tickformat=",.0f")
+    return _layout(fig, "Monthly Revenue vs. Peer Average", "Revenue")
+
+
+def margin_chart(data):
+    import plotly.graph_objects as go
+
+    margins = data["margins"]
+    fig = go.Figure()
+    for who in (COMPANY, PEERS):
+        for metric, dash in (("Gross Margin", "solid"), ("Net Margin", "dot")):
+            column = f"{who} {metric}"
+            fig.add_trace(go.Scatter(x=margins.index, y=margins[column], name=column, mode="lines+markers",
+                                     line={"color": COLORS[who], "dash": dash}))
+    fig.update_yaxes(ticksuffix="%")
+    return _layout(fig, "Quarterly Margins vs. Peer Average", "% of Total Income")
+
+
+def _mix_chart(frame, title, yaxis_title):
+    import plotly.graph_objects as go
+
+    fig = go.Figure([
+        go.Bar(x=frame.index, y=frame[column], name=column, marker_color=COLORS[column])
+        for column in (COMPANY, PEERS)
+        if frame[column].notna().any()
+    ])
+    fig.update_layout(barmode="group")
+    fig.update_yaxes(ticksuffix="%")
+    return _layout(fig, title, yaxis_title)
+
+
+def expense_mix_chart(data):
+    return _mix_chart(data["expense_mix"], "Expense Mix vs. Peer Average", "% of Total Income")
+
+
+def channel_chart(data):
+    return _mix_chart(data["channels"], "Sales by Channel vs. Peer Average", "% of Product Sales")
+
+
+def figures(data):
+    # Plotly figures are plain data sent to the browser; nothing is kept on the server
+    return [revenue_chart(data), margin_chart(data), expense_mix_chart(data), channel_chart(data)]
@@ -1,26 +1,58 @@
-from groq import Groq
-import requests
-import re
+import contextlib
+import contextvars
+import functools
+import hashlib
+import json
 import os
+import queue
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import streamlit as st
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-
-# Set up Groq API key
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from tenacity import retry, stop_after_attempt
+import charts
+from aggregates import load_group
+from http_clients import create_groq_client, groq_chat, perplexity_post, wait_retry_after
+from instrumentation import configure_from_env, count_retry, enabled as instrumentation_enabled, instrumented, record, stage
+from llm_cache import ResponseCache, make_key
+from paths import DATA_DIR, STATEMENT_PATH
+from peer_index import select_peers
+from periods import Periods, growth, periods_for
+from pipeline import run_stages
+from statement import KEY_LINES, load_statement
+from streaming import clean_market_report, iter_groq_content, iter_sse_content, sanitize_stream, strip_think
+from verify import ON_PAR_POINTS, verify_tables
+
+# The Groq client (and its SDK import) is created on first use
+_client = None
+_client_lock = threading.Lock()
 perplexity_api_key = os.environ.get("PERPLEXITY_API_KEY")
 
-# Simple cache for market reports and industry averages
-market_report_cache = {}
-industry_averages_cache = {}
-
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-def generate_market_report_perplexity(company_name):
-    if company_name in market_report_cache:
-        return market_report_cache[company_name]
-
-    url = "https://api.perplexity.ai/chat/completions"
+# Persistent cache for market reports, industry averages and analyses
+response_cache = ResponseCache()
+# Optional metrics sinks (JSON log, Prometheus endpoint) from the environment
+configure_from_env()
+
+def get_client():
+    # Set up Groq API key; the client keeps a pool of keep-alive connections
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_groq_client(os.environ.get("GROQ_API_KEY"))
+        return _client
+
+def record_completion(request, chat_completion=None):
+    # Request size and token usage for the current instrumentation stage
+    if not instrumentation_enabled():
+        return
+    record(payload_bytes=len(json.dumps(request)))
+    usage = getattr(chat_completion, "usage", None)
+    if usage is not None:
+        record(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+PERPLEXITY_URL = os.environ.get("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
+
+def market_report_payload(company_name):
     prompt = f"""Generate a detailed and accurate market report for {company_name}, a company in the CPG sector and Food & Beverage vertical. Include:
     1. Company Overview
     2. Market Size and Growth (use specific numbers and growth rates)
@@ -47,225 +79,537 @@ def generate_market_report_perplexity(company_name):
         "temperature": 0.01,
         "top_p": 0.9,
     }
+    return payload
 
-    headers = {
+def perplexity_headers():
+    return {
         "Authorization": f"Bearer {perplexity_api_key}",
         "Content-Type": "application/json"
     }
-    
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    result = response.json()["choices"][0]["message"]["content"]
-    
-    market_report = re.sub(r"[\*\#\-]", "", result)
-    market_report = market_report.replace("\n", "\n\n")
-    market_report = re.sub(r'\[\d+\]', '', market_report)
-    
-    market_report_cache[company_name] = market_report
-    return market_report
-
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-def calculate_averages_using_ai(documents, company_name):
-    if company_name in industry_averages_cache:
-        return industry_averages_cache[company_name]
-
-    prompt = f"""Analyze the following income statements from different companies in the {company_name}'s industry. Calculate and provide accurate industry averages for:
-
-    1. Quarterly "Total Income": Average of "Total Income" for each quarter across all companies
-    2. Quarterly "Total Income" Growth:
-       a. Calculate growth percentages: ((Q2 - Q1) / Q1) * 100, ((Q3 - Q2) / Q2) * 100, ((Q4 - Q3) / Q3) * 100
-       b. Take the average of these three growth percentages
-    3. Gross Margin: (("Gross Profit" / "Total Income") * 100) averaged across all companies
-    4. "Total Expenses" Ratio: (("Total Expenses" / "Total Income") * 100) averaged across all companies
-    5. Net Profit Margin: (("Net Profit" / "Total Income") * 100) averaged across all companies
-    6. "Total Cost Of Goods Sold" as % of "Total Income": (("Total Cost Of Goods Sold" / "Total Income") * 100) averaged across all companies
-
-    Income Statements:
-    {documents}
-
-    These industry averages should be calculated using data from synthetic_data_1.csv, synthetic_data_5.csv, and synthetic_data_6.csv files only.
-
-<<<<<<< HEAD
-    Provide the averages as "Industry Averages" without mentioning specific companies. Format the report professionally, using markdown tables where appropriate. Ensure all financial figures are in USD and use a dollar sign where applicable. Express all metrics as percentages where appropriate. Be extremely precise and consistent in your calculations, showing your work for each metric. DON'T MAKE STUFF UP. USE THE VALUES ONLY PROVIDED. MAKE SURE THE INDUSTRY AVERAGES AND THE COMPANY AVERAGES ARE DIFFERENT PLEASE!"""
-=======
-    Provide the averages as "Industry Averages" without mentioning specific companies. Format the report professionally, using markdown tables where appropriate. Ensure all financial figures are in USD and use a dollar sign where applicable. Express all metrics as percentages where appropriate. Be extremely precise and consistent in your calculations, showing your work for each metric. """
->>>>>>> 95ac8d80750926013ce5ce821c0d7d91435da7eb
-
-    chat_completion = client.chat.completions.create(
-        messages=[
+
+@instrumented("market_report")
+@retry(wait=wait_retry_after, stop=stop_after_attempt(3), before_sleep=count_retry)
+def generate_market_report_perplexity(company_name):
+    payload = market_report_payload(company_name)
+
+    def fetch():
+        response = perplexity_post(PERPLEXITY_URL, payload, perplexity_headers())
+        body = response.json()
+        usage = body.get("usage", {})
+        record(
+            payload_bytes=len(response.request.body or b""),
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+        return clean_market_report(body["choices"][0]["message"]["content"])
+
+    return response_cache.get_or_compute(make_key(url=PERPLEXITY_URL, payload=payload), fetch)
+
+@retry(wait=wait_retry_after, stop=stop_after_attempt(3), before_sleep=count_retry)
+def open_perplexity_stream(payload):
+    response = perplexity_post(PERPLEXITY_URL, {**payload, "stream": True}, perplexity_headers(), stream=True)
+    record(payload_bytes=len(response.request.body or b""))
+    return response
+
+def stream_market_report(company_name):
+    # Yields the sanitized report as it arrives and caches the full text
+    with stage("market_report_stream"):
+        payload = market_report_payload(company_name)
+
+        def open_stream():
+            with open_perplexity_stream(payload) as response:
+                yield from sanitize_stream(iter_sse_content(response), market_report=True)
+
+        yield from response_cache.stream_or_join(make_key(url=PERPLEXITY_URL, payload=payload), open_stream)
+
+METRIC_NAMES = [
+    "Quarterly Total Income Growth",
+    "Gross Margin",
+    "Total Expenses Ratio",
+    "Net Profit Margin",
+    "Total Cost Of Goods Sold % of Total Income",
+]
+# Fallback peer statements; the apps pick peers with peer_index.select_peers
+PEER_FILES = [os.path.join(DATA_DIR, f"synthetic_data_{i}.csv") for i in (1, 5, 6)]
+
+def nearest_peers(statement_path=STATEMENT_PATH, k=3):
+    # The app's peer group: the k most comparable statements, with running
+    # aggregates that are only updated when one of them changes. Each target keeps
+    # its own group so companies with different peers do not rewrite each other's
+    name = os.path.splitext(os.path.basename(statement_path))[0]
+    digest = hashlib.sha256(os.path.abspath(statement_path).encode()).hexdigest()[:8]
+    return load_group(f"nearest-{name}-{digest}-k{k}", select_peers(statement_path, k=k))
+
+def load_key_lines(file_path):
+    statement = load_statement(file_path)
+    return statement.lines(KEY_LINES), statement.months
+
+def window_growth(periods, quarterly_income):
+    # Mean quarter-over-quarter growth across the quarters in the trailing window
+    window = periods.window_quarters
+    if len(window) < 2:
+        return np.full(quarterly_income.shape[:-1], np.nan)
+    return growth(quarterly_income[..., window], 1)[..., 1:].mean(axis=-1)
+
+def compute_financial_metrics(values, months, calendar=None):
+    # values is a peers x KEY_LINES x months array; periods come from the month headers,
+    # and the ratios cover the trailing twelve months (the whole year for one-year statements)
+    periods = periods_for(months, calendar)
+    quarterly = periods.quarterly(values)
+    annual = periods.window(values)
+    income = annual[:, 0]
+    quarterly_income = quarterly[:, 0]
+    # Costs are stored as negative amounts
+    with np.errstate(invalid="ignore", divide="ignore"):
+        metrics = np.column_stack([
+            window_growth(periods, quarterly_income),
+            annual[:, 2] / income * 100,
+            -annual[:, 3] / income * 100,
+            annual[:, 4] / income * 100,
+            -annual[:, 1] / income * 100,
+        ])
+    return {
+        "periods": periods,
+        "quarters": periods.quarters,
+        "quarterly_income": quarterly_income,
+        "quarterly_yoy": periods.quarterly_yoy(values[:, 0]),
+        "ttm_income": periods.ttm(values[:, 0]),
+        "metrics": metrics,
+    }
+
+def load_peer_lines(peers):
+    # peers is a list of statement CSVs or a peer_store.PeerQuery
+    if hasattr(peers, "lines"):
+        return peers.lines(KEY_LINES)
+    loaded = [load_key_lines(file) for file in peers]
+    # Peers covering different months share one grid; months a peer lacks are NaN
+    periods = Periods.union([months for _, months in loaded])
+    return np.stack([periods.align(lines, months) for lines, months in loaded]), periods.grid_labels
+
+def peer_mean(values):
+    # Mean over the peer axis, skipping peers without data for a period
+    counts = (~np.isnan(values)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(values, axis=0) / counts
+
+@instrumented("industry_metrics")
+def calculate_industry_averages(peers):
+    # An aggregates.IndustryAggregate already holds the running averages
+    if hasattr(peers, "averages"):
+        return peers.averages()
+    values, months = load_peer_lines(peers)
+    result = compute_financial_metrics(values, months)
+    return {
+        "quarterly_income": pd.DataFrame(
+            {"Industry Average": peer_mean(result["quarterly_income"])}, index=result["quarters"]
+        ),
+        "metrics": pd.DataFrame(
+            {"Industry Average": peer_mean(result["metrics"])}, index=METRIC_NAMES
+        ),
+    }
+
+def industry_figures(averages):
+    # The averages in the form verify.verify_tables checks against
+    return {
+        "industry": averages["metrics"]["Industry Average"].to_dict(),
+        "industry_quarterly": averages["quarterly_income"]["Industry Average"].to_dict(),
+    }
+
+def expected_figures(statement_path, peers):
+    # Company and industry figures computed from the statements
+    lines, months = load_key_lines(statement_path)
+    company = compute_financial_metrics(lines[np.newaxis], months)
+    return {
+        "company": dict(zip(METRIC_NAMES, company["metrics"][0].tolist())),
+        "company_quarterly": dict(zip(company["quarters"], company["quarterly_income"][0].tolist())),
+        **industry_figures(calculate_industry_averages(peers)),
+    }
+
+def format_industry_averages(averages):
+    rows = ["| Quarter | Average Total Income |", "| --- | --- |"]
+    for quarter, value in averages["quarterly_income"]["Industry Average"].items():
+        rows.append(f"| {quarter} | ${value:,.2f} |")
+    rows += ["", "| Metric | Industry Average |", "| --- | --- |"]
+    for metric, value in averages["metrics"]["Industry Average"].items():
+        rows.append(f"| {metric} | {value:.2f}% |")
+    return "\n".join(rows)
+
+@instrumented("industry_averages")
+@retry(wait=wait_retry_after, stop=stop_after_attempt(3), before_sleep=count_retry)
+def calculate_averages_using_ai(peers, company_name):
+    # The numbers are computed locally; the model only writes the commentary
+    averages = calculate_industry_averages(peers)
+    averages_table = format_industry_averages(averages)
+
+    prompt = f"""The following industry averages were calculated from the income statements of companies in {company_name}'s industry:
+
+    {averages_table}
+
+    Write a short commentary (one or two paragraphs) on what these industry averages say about the industry's revenue trend, profitability and cost structure. Refer to the figures exactly as given and do not recalculate or add new figures. Do not mention specific companies."""
+
+    request = {
+        "messages": [
             {
                 "role": "system",
-<<<<<<< HEAD
-                "content": f"You are a financial analyst specializing in the CPG sector and Food & Beverage vertical. Provide accurate, data-driven industry averages for {company_name}'s sector. Use proper Markdown format, avoiding h1, h2, and h3 headers. Separate sections with blank lines. Denote all amounts in USD with a dollar sign. Ensure consistency and precision in all calculations, showing your work for each metric. DON'T MAKE STUFF UP. USE THE VALUES ONLY PROVIDED. MAKE SURE THE INDUSTRY AVERAGES AND THE COMPANY AVERAGES ARE DIFFERENT PLEASE!"
-=======
-                "content": f"You are a financial analyst specializing in the CPG sector and Food & Beverage vertical. Provide accurate, data-driven industry averages for {company_name}'s sector. Use proper Markdown format, avoiding h1, h2, and h3 headers. Separate sections with blank lines. Denote all amounts in USD with a dollar sign. Ensure consistency and precision in all calculations, showing your work for each metric.  Do not make assumptions, instead call out clearly where you lack information or data."
->>>>>>> 95ac8d80750926013ce5ce821c0d7d91435da7eb
+                "content": f"You are a financial analyst specializing in the CPG sector and Food & Beverage vertical. Provide accurate, data-driven commentary on industry averages for {company_name}'s sector. Use proper Markdown format, avoiding h1, h2, and h3 headers. Denote all amounts in USD with a dollar sign. DON'T MAKE STUFF UP. USE THE VALUES ONLY PROVIDED."
             },
             {
                 "role": "user",
                 "content": prompt,
             }
         ],
-        model="deepseek-r1-distill-llama-70b",
-        temperature=0.01,
-        max_tokens=3000,
-    )
-    
-    industry_averages = chat_completion.choices[0].message.content
-    industry_averages = re.sub(r'<think>.*?</think>', '', industry_averages, flags=re.DOTALL)
-
-    industry_averages_cache[company_name] = industry_averages
-
-    return industry_averages
-
+        "model": "deepseek-r1-distill-llama-70b",
+        "temperature": 0.01,
+        "max_tokens": 1500,
+    }
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-def analyze_company_standing(company_statement, industry_averages, market_report, company_name):
-    prompt = f"""Analyze {company_name}'s performance compared to industry benchmarks. Provide a detailed analysis in the following format:
+    def fetch():
+        chat_completion = groq_chat(get_client(), request)
+        record_completion(request, chat_completion)
+        commentary = strip_think(chat_completion.choices[0].message.content)
+        return f"{averages_table}\n\n{commentary.strip()}"
+
+    text = response_cache.get_or_compute(make_key(**request), fetch)
+    return verify_tables(text, industry_figures(averages), default_side="industry")[0]
+
+
+# Prompt size limits for the standing analysis
+STATEMENT_TOKEN_BUDGET = 600
+MARKET_REPORT_TOKEN_BUDGET = 1200
+# verify_analysis corrects the table figures, so a smaller model or budget can be used
+ANALYSIS_MODEL = os.environ.get("ANALYSIS_MODEL", "deepseek-r1-distill-llama-70b")
+ANALYSIS_MAX_TOKENS = int(os.environ.get("ANALYSIS_MAX_TOKENS", 5000))
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and figures
+    return -(-len(text) // 4)
+
+def truncate_to_tokens(text, token_budget):
+    if estimate_tokens(text) <= token_budget:
+        return text
+    cut = text[:token_budget * 4]
+    # Prefer ending on a paragraph boundary
+    if "\n\n" in cut:
+        cut = cut[:cut.rindex("\n\n")]
+    return cut.rstrip() + "\n\n(truncated)"
+
+def format_usd(value):
+    return f"-${-value:,.0f}" if value < 0 else f"${value:,.0f}"
+
+def markdown_table(header, rows):
+    lines = ["| " + " | ".join(header) + " |", "|" + " --- |" * len(header)]
+    lines += ["| " + " | ".join(row) + " |" for row in rows]
+    return "\n".join(lines)
+
+@instrumented("statement_summary")
+def build_statement_summary(statement_path, token_budget=STATEMENT_TOKEN_BUDGET):
+    # Compact quarterly view of a statement for prompts; returns (text, tokens)
+    statement = load_statement(statement_path)
+    months = statement.months
+    lines = statement.lines(KEY_LINES)
+    result = compute_financial_metrics(lines[np.newaxis], months)
+    periods = result["periods"]
+    # Only the quarters of the trailing window, so multi-year histories stay compact
+    shown = periods.window_quarters
+    quarters = [periods.quarters[i] for i in shown]
+    total = periods.window_label
+
+    def quarterly_rows(labels, values):
+        quarterly = periods.quarterly(values)[:, shown]
+        return [
+            [label] + [format_usd(v) for v in row] + [format_usd(window)]
+            for label, row, window in zip(labels, quarterly, periods.window(values))
+        ]
+
+    sections = [
+        "Quarterly totals (USD):\n" + markdown_table(["Line"] + quarters + [total], quarterly_rows(KEY_LINES, lines)),
+        "Ratios:\n" + markdown_table(
+            ["Metric", "Value"], [[name, f"{value:.2f}%"] for name, value in zip(METRIC_NAMES, result["metrics"][0])]
+        ),
+    ]
 
-    1. Key Metrics vs. Industry Benchmarks
-    Create a markdown table with the following columns:
+    # Optional detail, added only while it fits the budget
+    yoy = result["quarterly_yoy"][0, shown]
+    ttm_yoy = growth(result["ttm_income"][0], 12)[-1]
+    if np.isfinite(yoy).any() or np.isfinite(ttm_yoy):
+        row = ["Total Income"] + [f"{value:.2f}%" if np.isfinite(value) else "n/a" for value in [*yoy, ttm_yoy]]
+        sections.append("Year-over-year growth:\n" + markdown_table(["Line"] + quarters + ["TTM"], [row]))
+    channels = [
+        account.key for account in statement.accounts
+        if account.name.startswith("Income.") and "Sales of Product Income - " in account.label
+    ]
+    if channels:
+        labels = [statement.account(key).label.split(" - ")[-1] for key in channels]
+        sections.append("Sales by channel (USD):\n" + markdown_table(["Channel"] + quarters + [total], quarterly_rows(labels, statement.lines(channels))))
+    if "Total Expenses" in statement:
+        categories = statement.account("Total Expenses").children
+        totals = -periods.window(statement.lines([account.key for account in categories]))
+        order = np.argsort(totals)[::-1]
+        sections.append(f"Largest expense categories, {total} (USD):\n" + markdown_table(
+            ["Category", "Amount"], [[categories[i].label, format_usd(totals[i])] for i in order]
+        ))
+
+    summary = "\n\n".join(sections[:2])
+    for section in sections[2:]:
+        candidate = summary + "\n\n" + section
+        if estimate_tokens(candidate) > token_budget:
+            break
+        summary = candidate
+    return summary, estimate_tokens(summary)
+
+# The standing analysis is generated section by section. Each section names the inputs
+# it reads, so only those go into its prompt and its cache key: a new market report or a
+# correction to one section regenerates that section and leaves the others cached.
+ANALYSIS_SECTIONS = {
+    "metrics": {
+        "title": "Key Metrics vs. Industry Benchmarks",
+        "inputs": ("company_statement", "industry_averages"),
+        "share": 0.4,
+        "instructions": """Create a markdown table with the following columns:
     - Metric
-    - {company_name} (calculate from the company data in original_data.csv)
+    - {company_name} (use the ratios in the company data)
     - Industry Average (use the provided industry averages)
-    - Verdict (use "Outperforming", "On par", or "Underperforming")
+    - Verdict: "On par" when the company is within {on_par:g} percentage points of the industry average, otherwise "Outperforming" or "Underperforming" (for the expenses ratio and the cost of goods sold share, lower than the industry is outperforming)
     Include these metrics:
-    - Quarterly "Total Income" Growth: Average of ((Q2 - Q1) / Q1) * 100, ((Q3 - Q2) / Q2) * 100, ((Q4 - Q3) / Q3) * 100
+    - Quarterly "Total Income" Growth: average quarter-over-quarter growth, ((this quarter - previous quarter) / previous quarter) * 100, across the quarters shown in the company data
     - Gross Margin: ("Gross Profit" / "Total Income") * 100
     - Net Profit Margin: ("Net Profit" / "Total Income") * 100
     - "Total Expenses" Ratio: ("Total Expenses" / "Total Income") * 100
     - "Total Cost Of Goods Sold" as % of "Total Income": ("Total Cost Of Goods Sold" / "Total Income") * 100
-
-    2. Operational Highlights
-    - Strengths: List 3 top performing areas with specific data points
-    - Weaknesses: List 3 areas needing improvement with specific data points
-
-    3. Strategic Recommendations
-    Provide 3 detailed, actionable recommendations based on the company's performance and market conditions.
+    Show your work for each metric calculation below the table.""",
+    },
+    "highlights": {
+        "title": "Operational Highlights",
+        "inputs": ("company_statement", "industry_averages"),
+        "share": 0.3,
+        "instructions": """- Strengths: List 3 top performing areas with specific data points
+    - Weaknesses: List 3 areas needing improvement with specific data points""",
+    },
+    "recommendations": {
+        "title": "Strategic Recommendations",
+        "inputs": ("company_statement", "industry_averages", "market_report"),
+        "share": 0.3,
+        "instructions": "Provide 3 detailed, actionable recommendations based on the company's performance and market conditions.",
+    },
+}
+SECTION_INPUTS = {"company_statement": "Company Data", "industry_averages": "Industry Averages", "market_report": "Market Report"}
+SECTION_SEPARATOR = "\n\n---\n\n"
+
+def section_request(section, inputs, company_name, correction=None):
+    # inputs maps input names to text; only the section's own inputs are sent
+    spec = ANALYSIS_SECTIONS[section]
+    data = []
+    for name in spec["inputs"]:
+        text = inputs[name]
+        if name == "market_report":
+            text = truncate_to_tokens(text, MARKET_REPORT_TOKEN_BUDGET)
+        data.append(f"{SECTION_INPUTS[name]}:\n    {text}")
+    if correction:
+        data.append(f"Corrections from {company_name} (these take precedence over the data above):\n    {correction}")
+    data = "\n\n    ".join(data)
+
+    prompt = f"""Analyze {company_name}'s performance compared to industry benchmarks. Write only the "{spec['title']}" section of the analysis, starting with a h4 header of that name.
+
+    {spec['instructions'].format(company_name=company_name, on_par=ON_PAR_POINTS)}
 
     Use the following data for your analysis:
-    Company Data: {company_statement}
-    Industry Averages: {industry_averages}
-    Market Report: {market_report}
+    {data}
 
-    Format your response using markdown, with appropriate headers (h4 or smaller) and bullet points. Separate each section with a horizontal rule (---).
-    Ensure all financial figures are in USD and use a dollar sign where applicable. Express all metrics as percentages where appropriate. Be specific and data-driven in your analysis. Maintain consistency and accuracy in all calculations and comparisons. Show your work for each metric calculation. DON'T MAKE STUFF UP. USE THE VALUES ONLY PROVIDED. MAKE SURE THE INDUSTRY AVERAGES AND THE COMPANY AVERAGES ARE DIFFERENT PLEASE!"""
+    Format your response using markdown, with appropriate headers (h4 or smaller) and bullet points. Do not add horizontal rules.
+    Ensure all financial figures are in USD and use a dollar sign where applicable. Express all metrics as percentages where appropriate. Be specific and data-driven in your analysis. Maintain consistency and accuracy in all calculations and comparisons. DON'T MAKE STUFF UP. USE THE VALUES ONLY PROVIDED. MAKE SURE THE INDUSTRY AVERAGES AND THE COMPANY AVERAGES ARE DIFFERENT PLEASE!"""
 
-    chat_completion = client.chat.completions.create(
-        messages=[
+    request = {
+        "messages": [
             {
                 "role": "system",
-<<<<<<< HEAD
                 "content": f"You are a financial analyst specializing in the CPG sector and Food & Beverage vertical. Provide an accurate, data-driven analysis of {company_name}'s performance compared to industry benchmarks. Use proper Markdown format, avoiding h1, h2, and h3 headers. Separate sections with blank lines. Denote all amounts in USD with a dollar sign. Ensure consistency and precision in all calculations and comparisons, showing your work for each metric. DON'T MAKE STUFF UP. USE THE VALUES ONLY PROVIDED. MAKE SURE THE INDUSTRY AVERAGES AND THE COMPANY AVERAGES ARE DIFFERENT PLEASE!"
-=======
-                "content": f"You are a financial analyst specializing in the CPG sector and Food & Beverage vertical. Provide an accurate, data-driven analysis of {company_name}'s performance compared to industry benchmarks. Use proper Markdown format, avoiding h1, h2, and h3 headers. Separate sections with blank lines. Denote all amounts in USD with a dollar sign. Ensure consistency and precision in all calculations and comparisons, showing your work for each metric.  Do not make assumptions, instead call out clearly where you lack information or data."
->>>>>>> 95ac8d80750926013ce5ce821c0d7d91435da7eb
             },
             {
                 "role": "user",
                 "content": prompt,
             }
         ],
-        model="deepseek-r1-distill-llama-70b",
-        temperature=0.01,
-        max_tokens=5000,
-    )
-    
-    analysis = chat_completion.choices[0].message.content
-    analysis = re.sub(r'<think>.*?</think>', '', analysis, flags=re.DOTALL)
-
-    return analysis
-
-def generate_visualizations():
-    # Load main revenue data
-    df = pd.read_csv("data/original_data.csv")
-    # Extract revenue for 'Total Income'
-    revenue = df[df["Name"] == "Total Income"].set_index("Name")
-    # Define monthly columns
-    monthly_columns = [
-        "Jan 2024", "Feb 2024", "Mar 2024",
-        "Apr 2024", "May 2024", "Jun 2024",
-        "Jul 2024", "Aug 2024", "Sep 2024",
-        "Oct 2024", "Nov 2024", "Dec 2024"
-    ]
-    revenue = revenue[monthly_columns]
-    # Define quarters
-    quarters = {
-        "Q1 2024": ["Jan 2024", "Feb 2024", "Mar 2024"],
-        "Q2 2024": ["Apr 2024", "May 2024", "Jun 2024"],
-        "Q3 2024": ["Jul 2024", "Aug 2024", "Sep 2024"],
-        "Q4 2024": ["Oct 2024", "Nov 2024", "Dec 2024"]
+        "model": ANALYSIS_MODEL,
+        "temperature": 0.01,
+        "max_tokens": round(ANALYSIS_MAX_TOKENS * spec["share"]),
     }
-    # Calculate quarterly revenue
-    quarterly_revenue = {q: revenue[months].sum(axis=1).values[0] for q, months in quarters.items()}
-    # Convert to DataFrame
-    quarterly_df = pd.DataFrame(list(quarterly_revenue.items()), columns=["Quarter", "Revenue"])
-    # Load industry benchmark data from three CSV files
-    industry_files = ["data/synthetic_data_1.csv", "data/synthetic_data_5.csv", "data/synthetic_data_6.csv"]
-    # Initialize empty DataFrame for industry averages
-    industry_data = []
-    for file in industry_files:
-        industry_df = pd.read_csv(file)
-        industry_revenue = industry_df[industry_df["Name"] == "Total Income"].set_index("Name")
-        industry_revenue = industry_revenue[monthly_columns]
-        # Calculate industry quarterly revenue
-        industry_quarterly = {q: industry_revenue[months].sum(axis=1).values[0] for q, months in quarters.items()}
-        industry_data.append(industry_quarterly)
-    # Compute the industry benchmark as the average across the three files
-    industry_avg = {q: sum(d[q] for d in industry_data) / len(industry_data) for q in quarters.keys()}
-    # Convert industry benchmark to DataFrame
-    industry_df = pd.DataFrame(list(industry_avg.items()), columns=["Quarter", "Industry Avg"])
-    # Merge both DataFrames
-    final_df = quarterly_df.merge(industry_df, on="Quarter")
-    # Plot Quarterly Revenue
-    fig, ax = plt.subplots(figsize=(8, 5))
-    ax.plot(final_df["Quarter"], final_df["Revenue"], marker='o', linestyle='-', label="Company Revenue", color='b')
-    ax.plot(final_df["Quarter"], final_df["Industry Avg"], marker='s', linestyle='--', label="Industry Avg", color='r')
-    # Formatting
-    ax.set_xlabel("Quarter")
-    ax.set_ylabel("Revenue")
-    ax.set_title("Quarterly Revenue vs. Industry Benchmark")
-    ax.legend()
-    ax.grid()
-    return [fig]
+    return request
+
+@retry(wait=wait_retry_after, stop=stop_after_attempt(3), before_sleep=count_retry)
+def fetch_section(request):
+    def fetch():
+        chat_completion = groq_chat(get_client(), request)
+        record_completion(request, chat_completion)
+        return strip_think(chat_completion.choices[0].message.content).strip()
+
+    return response_cache.get_or_compute(make_key(**request), fetch)
+
+def generate_section(section, inputs, company_name, correction=None):
+    # The stage encloses every attempt, so its record counts the retries
+    with stage("analysis_section", section=section):
+        return fetch_section(section_request(section, inputs, company_name, correction))
+
+def stream_section(section, inputs, company_name, correction=None):
+    # Streaming variant of generate_section sharing the same cache entry
+    with stage("analysis_section", section=section):
+        request = section_request(section, inputs, company_name, correction)
+
+        def open_stream():
+            return sanitize_stream(iter_groq_content(open_groq_stream(request)))
+
+        yield from response_cache.stream_or_join(make_key(**request), open_stream)
+
+def section_stages(company_name, corrections=None):
+    # run_stages stages named after the sections; each waits only for its own inputs
+    corrections = corrections or {}
+
+    def section_stage(section):
+        def run(*values):
+            inputs = dict(zip(ANALYSIS_SECTIONS[section]["inputs"], values))
+            return generate_section(section, inputs, company_name, corrections.get(section))
+
+        return run, list(ANALYSIS_SECTIONS[section]["inputs"])
+
+    return {section: section_stage(section) for section in ANALYSIS_SECTIONS}
+
+def join_sections(sections):
+    return SECTION_SEPARATOR.join(sections[name].strip() for name in ANALYSIS_SECTIONS)
+
+@instrumented("analysis")
+def analyze_company_standing(company_statement, industry_averages, market_report, company_name, corrections=None):
+    # corrections maps section names to user-supplied corrections for that section.
+    # Sections are independent, so the ones not already cached are generated in parallel.
+    inputs = {"company_statement": company_statement, "industry_averages": industry_averages, "market_report": market_report}
+    corrections = corrections or {}
+    stages = {
+        section: (functools.partial(generate_section, section, inputs, company_name, corrections.get(section)), [])
+        for section in ANALYSIS_SECTIONS
+    }
+    return join_sections(run_stages(stages))
+
+def verify_analysis(analysis, statement_path, peers, patch=True):
+    # Checks the model's tables against the statements; returns (text, issues)
+    return verify_tables(analysis, expected_figures(statement_path, peers), patch=patch)
+
+@retry(wait=wait_retry_after, stop=stop_after_attempt(3), before_sleep=count_retry)
+def open_groq_stream(request):
+    stream = groq_chat(get_client(), request, stream=True)
+    record_completion(request)
+    return stream
+
+def stream_company_standing(company_statement, industry_averages, market_report, company_name, corrections=None):
+    # Streaming variant of analyze_company_standing sharing its cache entries. The inputs
+    # may be Futures: every section starts on the call, as soon as its own inputs are
+    # ready. The first section streams live and the later ones follow from what has
+    # arrived for them meanwhile.
+    values = {"company_statement": company_statement, "industry_averages": industry_averages, "market_report": market_report}
+    corrections = corrections or {}
+    queues = {section: queue.Queue() for section in ANALYSIS_SECTIONS}
+    stop = threading.Event()
+
+    def produce(section):
+        try:
+            inputs = {
+                name: values[name].result() if isinstance(values[name], Future) else values[name]
+                for name in ANALYSIS_SECTIONS[section]["inputs"]
+            }
+            with contextlib.closing(stream_section(section, inputs, company_name, corrections.get(section))) as chunks:
+                for text in chunks:
+                    if stop.is_set():
+                        return
+                    queues[section].put(text)
+            queues[section].put(None)
+        except Exception as exc:
+            queues[section].put(exc)
+
+    for section in ANALYSIS_SECTIONS:
+        threading.Thread(target=contextvars.copy_context().run, args=(produce, section), daemon=True).start()
+    return read_sections(queues, stop)
+
+def read_sections(queues, stop):
+    # The sections of stream_company_standing in order, with their separators
+    with stage("analysis_stream"):
+        try:
+            for index, section in enumerate(ANALYSIS_SECTIONS):
+                if index:
+                    yield SECTION_SEPARATOR
+                while True:
+                    item = queues[section].get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            # An abandoned stream stops the sections still generating
+            stop.set()
+
+@instrumented("visualizations")
+def generate_visualizations(statement_path=STATEMENT_PATH, peers=PEER_FILES, data=None):
+    # Plotly figures for revenue, margins, expense mix and channels against the peers
+    return charts.figures(charts.chart_data(statement_path, peers) if data is None else data)
+
+# Per-stage time limits in seconds, including retries; each analysis section has its own
+STAGE_TIMEOUTS = {
+    "market_report": 240,
+    "industry_averages": 240,
+    **{section: 360 for section in ANALYSIS_SECTIONS},
+}
+
+@instrumented("run_analysis")
+def run_analysis(company_name, statement_path=STATEMENT_PATH, peers=PEER_FILES, market_report=None, timeouts=STAGE_TIMEOUTS, include_analysis=True, company_statement=None):
+    # The market report and industry averages are independent, so they run in
+    # parallel, and each analysis section starts once its own inputs are done: only
+    # the recommendations wait for the market report. Callers that stream the
+    # analysis themselves pass include_analysis=False.
+    stages = {
+        "market_report": (lambda: market_report or generate_market_report_perplexity(company_name), []),
+        "industry_averages": (lambda: calculate_averages_using_ai(peers, company_name), []),
+        "company_statement": (lambda: company_statement or build_statement_summary(statement_path)[0], []),
+    }
+    if include_analysis:
+        stages.update(section_stages(company_name))
+        stages["analysis"] = (
+            lambda *sections: verify_analysis(join_sections(dict(zip(ANALYSIS_SECTIONS, sections))), statement_path, peers)[0],
+            list(ANALYSIS_SECTIONS),
+        )
+    return run_stages(stages, timeouts=timeouts)
 
 def main():
+    import streamlit as st
+
     st.title("Company Financial Analysis")
 
     company_name = st.text_input("Enter company name:", "B.T.R Nation")
     st.session_state.company_name = company_name
 
     if st.button("Generate Analysis"):
-        with st.spinner("Generating market report..."):
-            market_report = generate_market_report_perplexity(company_name)
-
-        with st.spinner("Calculating industry averages..."):
-            file_paths_companies_2_to_9 = [
-                'data/synthetic_data_1.csv',
-                'data/synthetic_data_5.csv',
-                'data/synthetic_data_6.csv',
-            ]
-            documents_companies_2_to_9 = [open(file, 'r').read() for file in file_paths_companies_2_to_9]
-            industry_averages = calculate_averages_using_ai(documents_companies_2_to_9, company_name)
-        
-        with st.spinner("Analyzing company standing..."):
-            with open('data/original_data.csv', 'r') as f:
-                company_1_statement_content = f.read()
-            analysis = analyze_company_standing(company_1_statement_content, industry_averages, market_report, company_name)
-        
+        peers = select_peers(STATEMENT_PATH)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            statement = pool.submit(lambda: build_statement_summary(STATEMENT_PATH)[0])
+            averages = pool.submit(calculate_averages_using_ai, peers, company_name)
+            report = pool.submit(generate_market_report_perplexity, company_name)
+            # The sections start as soon as their own inputs are ready, while the report is still running
+            sections = stream_company_standing(statement, averages, report, company_name)
+            with st.spinner("Generating market report and industry averages..."):
+                results = {"market_report": report.result(), "industry_averages": averages.result()}
+
         st.subheader("Market Report")
-        st.markdown(market_report)
+        st.markdown(results["market_report"])
 
         st.subheader("Industry Averages")
-        st.markdown(industry_averages)
+        st.markdown(results["industry_averages"])
 
         st.subheader("Analysis of Company's Standing")
-        st.markdown(analysis)
-
-        with st.spinner("Generating visualizations..."):
-            figures = generate_visualizations()
-            for fig in figures:
-                st.pyplot(fig)
+        placeholder = st.empty()
+        with placeholder.container():
+            analysis = st.write_stream(sections)
+        analysis, issues = verify_analysis(analysis, STATEMENT_PATH, peers)
+        if issues:
+            placeholder.markdown(analysis)
+
+        for fig in generate_visualizations(peers=peers):
+            st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
     main()
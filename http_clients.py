@@ -0,0 +1,180 @@
+import email.utils
+import os
+import threading
+import time
+from collections import deque
+
+from tenacity import wait_random_exponential
+
+# Connect and read timeouts in seconds
+CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 120))
+# Keep-alive connections per provider
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 16))
+
+
+class RateLimited(Exception):
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} rate limit hit, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    # Token buckets for requests/min and tokens/min; callers are served in arrival order
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_allowance = float(requests_per_minute)
+        self.token_allowance = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.condition = threading.Condition()
+        self.queue = deque()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_allowance = min(self.requests_per_minute, self.request_allowance + elapsed * self.requests_per_minute / 60)
+        self.token_allowance = min(self.tokens_per_minute, self.token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def _delay(self, now, tokens):
+        delays = [self.blocked_until - now]
+        if self.request_allowance < 1:
+            delays.append((1 - self.request_allowance) * 60 / self.requests_per_minute)
+        if self.token_allowance < tokens:
+            delays.append((tokens - self.token_allowance) * 60 / self.tokens_per_minute)
+        return max(delays)
+
+    def acquire(self, tokens=0):
+        # A single request larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        ticket = object()
+        with self.condition:
+            self.queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.queue[0] is ticket:
+                        delay = self._delay(now, tokens)
+                        if delay <= 0:
+                            self.request_allowance -= 1
+                            self.token_allowance -= tokens
+                            return
+                        self.condition.wait(delay)
+                    else:
+                        self.condition.wait()
+            finally:
+                self.queue.remove(ticket)
+                self.condition.notify_all()
+
+    def backoff(self, seconds):
+        # Pauses every queued caller, e.g. after a 429 with Retry-After
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+
+limiters = {
+    "perplexity": RateLimiter(
+        int(os.environ.get("PERPLEXITY_RPM", 50)), int(os.environ.get("PERPLEXITY_TPM", 200000))
+    ),
+    "groq": RateLimiter(
+        int(os.environ.get("GROQ_RPM", 30)), int(os.environ.get("GROQ_TPM", 50000))
+    ),
+}
+
+
+def request_tokens(messages, max_tokens):
+    # Budgeted size of a request: prompt estimate plus the completion allowance
+    return sum(len(message["content"]) for message in messages) // 4 + (max_tokens or 0)
+
+
+def parse_retry_after(value, default=1.0):
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # Neither seconds nor an HTTP date
+        return default
+    return max(parsed.timestamp() - time.time(), 0.0)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def perplexity_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Imported on first use to keep app startup light
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def perplexity_post(url, payload, headers, stream=False):
+    limiter = limiters["perplexity"]
+    limiter.acquire(request_tokens(payload["messages"], payload.get("max_tokens")))
+    response = perplexity_session().post(
+        url, json=payload, headers=headers, stream=stream, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+    )
+    if response.status_code == 429:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        response.close()
+        limiter.backoff(retry_after)
+        raise RateLimited("perplexity", retry_after)
+    response.raise_for_status()
+    return response
+
+
+def create_groq_client(api_key):
+    # Retries are handled by tenacity and the scheduler, not the SDK
+    import httpx
+    from groq import Groq
+
+    return Groq(
+        api_key=api_key,
+        max_retries=0,
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        ),
+    )
+
+
+def groq_chat(client, request, stream=False):
+    from groq import RateLimitError
+
+    limiter = limiters["groq"]
+    limiter.acquire(request_tokens(request["messages"], request.get("max_tokens")))
+    try:
+        if stream:
+            return client.chat.completions.create(**request, stream=True)
+        return client.chat.completions.create(**request)
+    except RateLimitError as exc:
+        retry_after = parse_retry_after(exc.response.headers.get("retry-after"))
+        limiter.backoff(retry_after)
+        raise RateLimited("groq", retry_after) from exc
+
+
+_exponential = wait_random_exponential(min=1, max=60)
+
+
+def wait_retry_after(retry_state):
+    # tenacity wait: rate-limited calls wait in the scheduler queue instead of backing off blindly
+    if isinstance(retry_state.outcome.exception(), RateLimited):
+        return 0
+    return _exponential(retry_state)
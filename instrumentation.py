@@ -0,0 +1,272 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stage records are only built while at least one sink is attached
+_sinks = []
+_sinks_lock = threading.Lock()
+_local = threading.local()
+# Attributes added to every record, e.g. the app session; threads started through
+# pipeline.run_stages (or copy_context) inherit them
+_scope = contextvars.ContextVar("instrumentation_scope", default={})
+# Fields summed when a stage reports them more than once
+COUNTERS = ("retries", "prompt_tokens", "completion_tokens", "payload_bytes", "cache_hits", "cache_misses")
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def add_sink(sink):
+    with _sinks_lock:
+        if sink not in _sinks:
+            _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def bind(**attrs):
+    # Tags the records of the current context from here on
+    _scope.set({**_scope.get(), **attrs})
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class _Stage:
+    __slots__ = ("record", "started")
+
+    def __init__(self, name, attrs):
+        self.record = {"stage": name, "status": "ok", **_scope.get(), **attrs}
+
+    def __enter__(self):
+        self.record["timestamp"] = time.time()
+        self.started = time.perf_counter()
+        _stack().append(self.record)
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["seconds"] = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.record["status"] = "error"
+            self.record["error"] = exc_type.__name__
+        stack = _stack()
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index] is self.record:
+                del stack[index]
+                break
+        for sink in list(_sinks):
+            sink.emit(self.record)
+
+
+class _NullStage:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, **attrs):
+    # Times the enclosed block and sends one record to every sink
+    if not _sinks:
+        return _NULL_STAGE
+    return _Stage(name, attrs)
+
+
+def instrumented(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+            with _Stage(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def emit(name, seconds, **values):
+    # Sends a record for work timed outside a stage() block
+    if not _sinks:
+        return
+    entry = {"stage": name, "status": "ok", "timestamp": time.time() - seconds, "seconds": seconds, **_scope.get(), **values}
+    for sink in list(_sinks):
+        sink.emit(entry)
+
+
+def current():
+    # The innermost running stage record on this thread, or None
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def attached(stage_record):
+    # Lets work on another thread add values (tokens, retries) to a stage started elsewhere
+    if stage_record is None:
+        yield
+        return
+    stack = _stack()
+    stack.append(stage_record)
+    try:
+        yield
+    finally:
+        stack.remove(stage_record)
+
+
+def record(**values):
+    # Adds values to the innermost running stage on this thread
+    if not _sinks:
+        return
+    stack = _stack()
+    if not stack:
+        return
+    current = stack[-1]
+    for key, value in values.items():
+        if key in COUNTERS:
+            current[key] = current.get(key, 0) + value
+        else:
+            current[key] = value
+
+
+def count_retry(retry_state):
+    # tenacity before_sleep hook
+    record(retries=1)
+
+
+class JsonLogSink:
+    # One JSON object per line
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+            else:
+                print(line, file=sys.stderr)
+
+
+class MemorySink:
+    # Keeps the latest records, e.g. for the debug panel in main.py
+    def __init__(self, maxlen=500):
+        self.records = deque(maxlen=maxlen)
+
+    def emit(self, record):
+        self.records.append(dict(record))
+
+
+class SubscribedSink:
+    # Attaches a sink only while at least one subscriber (e.g. an app session with the
+    # debug panel open) wants it; subscribers that stop checking in expire after ttl seconds
+    def __init__(self, sink, ttl=600):
+        self.sink = sink
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, key, wanted=True):
+        with self.lock:
+            now = time.monotonic()
+            if wanted:
+                self.subscribers[key] = now
+            else:
+                self.subscribers.pop(key, None)
+            for stale in [k for k, seen in self.subscribers.items() if now - seen > self.ttl]:
+                del self.subscribers[stale]
+            if self.subscribers:
+                add_sink(self.sink)
+            else:
+                remove_sink(self.sink)
+
+
+class PrometheusSink:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def emit(self, record):
+        with self.lock:
+            totals = self.stages.setdefault(record["stage"], {"count": 0, "errors": 0, "seconds": 0.0})
+            totals["count"] += 1
+            totals["errors"] += record["status"] != "ok"
+            totals["seconds"] += record["seconds"]
+            for key in COUNTERS:
+                totals[key] = totals.get(key, 0) + record.get(key, 0)
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        metrics = [
+            ("finbot_stage_runs_total", "count", "Stage executions"),
+            ("finbot_stage_errors_total", "errors", "Stage executions that raised"),
+            ("finbot_stage_seconds_total", "seconds", "Wall time spent in the stage"),
+        ] + [(f"finbot_stage_{key}_total", key, f"Sum of {key.replace('_', ' ')}") for key in COUNTERS]
+        with self.lock:
+            for metric, key, help_text in metrics:
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name, totals in sorted(self.stages.items()):
+                    lines.append(f'{metric}{{stage="{name}"}} {totals.get(key, 0)}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def configure_from_env():
+    # FINBOT_METRICS_LOG=<path or "-"> and FINBOT_METRICS_PORT=<port> attach sinks;
+    # the endpoint listens on localhost unless FINBOT_METRICS_HOST says otherwise
+    log_path = os.environ.get("FINBOT_METRICS_LOG")
+    if log_path:
+        add_sink(JsonLogSink(None if log_path == "-" else log_path))
+    port = os.environ.get("FINBOT_METRICS_PORT")
+    if port:
+        sink = PrometheusSink()
+        try:
+            sink.serve(int(port), os.environ.get("FINBOT_METRICS_HOST", "127.0.0.1"))
+        except OSError:
+            # Another process (e.g. a batch worker) already serves this port
+            return
+        add_sink(sink)
@@ -0,0 +1,250 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process coalescing
+    fcntl = None
+
+from instrumentation import attached, current, record
+from paths import CACHE_DIR
+
+# On-disk cache for LLM responses shared by all Streamlit workers
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_responses.sqlite3"))
+CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def make_key(**parts):
+    # Stable hash of model, messages, parameters and any input data
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class SingleFlight:
+    # Concurrent callers for the same key share the first caller's future
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def begin(self, key):
+        with self.lock:
+            if key in self.calls:
+                return self.calls[key], False
+            future = Future()
+            self.calls[key] = future
+            return future, True
+
+    def end(self, key):
+        with self.lock:
+            self.calls.pop(key, None)
+
+
+class StreamFlight:
+    # Text of one upstream stream as it arrives; every reader replays it from the start
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.parts = []
+        self.done = False
+        self.error = None
+
+    def append(self, text):
+        with self.cond:
+            self.parts.append(text)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def read(self):
+        index = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: index < len(self.parts) or self.done)
+                new = self.parts[index:]
+                index += len(new)
+                finished = self.done and index == len(self.parts)
+                error = self.error
+            yield from new
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.flights = SingleFlight()
+        self.streams = {}
+        self.streams_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        self.lock_dir = os.path.join(directory or ".", "locks")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def _connect(self):
+        # A fresh connection per operation keeps the cache safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _Transaction(conn)
+
+    def get(self, key, count=True):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                if count:
+                    conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+                    record(cache_misses=1)
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+            record(cache_hits=1)
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now)
+            )
+            conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    @contextlib.contextmanager
+    def _process_lock(self, key):
+        # Serializes the same request across processes sharing this cache. Each key has its
+        # own lock file: flock also conflicts within a process, so shared files would make
+        # unrelated requests wait for each other
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.lock_dir, f"{key}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_compute(self, key, compute):
+        # Only one caller per key runs compute; the others wait for its result
+        value = self.get(key)
+        if value is not None:
+            return value
+        future, leader = self.flights.begin(key)
+        if not leader:
+            return future.result()
+        try:
+            with self._process_lock(key):
+                # Another process may have finished the same request meanwhile
+                value = self.get(key, count=False)
+                if value is None:
+                    value = compute()
+                    self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            self.flights.end(key)
+
+    def stream_or_join(self, key, open_stream):
+        # Streaming counterpart of get_or_compute. One background thread per key drains
+        # the upstream stream into the cache; every caller, in this process, reads the
+        # chunks as they arrive, and a caller that stops reading affects nobody else.
+        # Other processes wait on the key's lock and then read the cached text.
+        value = self.get(key)
+        if value is not None:
+            yield value
+            return
+        with self.streams_lock:
+            flight = self.streams.get(key)
+            if flight is None:
+                flight = self.streams[key] = StreamFlight()
+                drain = contextvars.copy_context().run
+                threading.Thread(target=drain, args=(self._drain, key, open_stream, flight, current()), daemon=True).start()
+        yield from flight.read()
+
+    def _drain(self, key, open_stream, flight, stage_record):
+        # Tokens and retries are counted in the stage of the caller that started the stream
+        try:
+            with attached(stage_record), self._process_lock(key):
+                # Another process may have finished the same request meanwhile
+                value = self.get(key, count=False)
+                if value is None:
+                    parts = []
+                    for text in open_stream():
+                        parts.append(text)
+                        flight.append(text)
+                    self.set(key, "".join(parts))
+                else:
+                    flight.append(value)
+            flight.finish()
+        except BaseException as exc:
+            flight.finish(exc)
+        finally:
+            with self.streams_lock:
+                self.streams.pop(key, None)
+
+    def stats(self):
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": counters["hits"], "misses": counters["misses"], "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("UPDATE counters SET value = 0")
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
@@ -1,12 +1,17 @@
+import time
+from pathlib import Path
 import streamlit as st
-from PIL import Image
-import pandas as pd
-import matplotlib.pyplot as plt
-from financial_analysis import generate_market_report_perplexity, analyze_company_standing, calculate_averages_using_ai, generate_visualizations
+import instrumentation
+from paths import PACKAGE_DIR, STATEMENT_PATH
 
+# The analysis modules (pandas, groq, plotly, ...) are imported on first use
+rerun_started = time.perf_counter()
+
+# Images live next to this file
+IMAGES_DIR = Path(PACKAGE_DIR) / "images"
 
 # Set page config
-st.set_page_config(page_title="FinBot", page_icon="/Users/mehak/Documents/GitHub/hack-a-thon-analysis/images/logo.png", layout="wide")
+st.set_page_config(page_title="FinBot", page_icon=str(IMAGES_DIR / "logo.png"), layout="wide")
 
 # Define colors
 primary_color = "#6bc72e"
@@ -156,11 +161,33 @@ if 'market_report' not in st.session_state:
     st.session_state.market_report = ""
 if 'show_prompt' not in st.session_state:
     st.session_state.show_prompt = False
+if 'snapshot' not in st.session_state:
+    st.session_state.snapshot = None
+if 'prefetch' not in st.session_state:
+    st.session_state.prefetch = None
+if 'prefetch_error' not in st.session_state:
+    st.session_state.prefetch_error = None
+# Prefetch stages whose outcome this session has already picked up, whatever the value
+if 'prefetch_done' not in st.session_state:
+    st.session_state.prefetch_done = set()
+if 'show_analysis' not in st.session_state:
+    st.session_state.show_analysis = False
+
+# Seconds between refreshes of a tab that is waiting on background work
+PREFETCH_POLL = 0.5
+
+# Load images once per server process instead of on every rerun
+@st.cache_resource
+def load_image(name):
+    from PIL import Image
+
+    image = Image.open(IMAGES_DIR / name)
+    image.load()
+    return image
 
-# Load images
-main_logo = Image.open("/Users/mehak/Documents/GitHub/hack-a-thon-analysis/images/main_logo.png")
-overview_image = Image.open("/Users/mehak/Documents/GitHub/hack-a-thon-analysis/images/overview.jpeg")
-finbot_image = Image.open("/Users/mehak/Documents/GitHub/hack-a-thon-analysis/images/finbot.jpg")
+main_logo = load_image("main_logo.png")
+overview_image = load_image("overview.jpeg")
+finbot_image = load_image("finbot.jpg")
 
 # Sidebar with branding and description
 with st.sidebar:
@@ -179,6 +206,112 @@ with st.sidebar:
         
         <p class="highlight">Let mypocketCFO be your trusted financial partner on your journey to success!</p>
     """, unsafe_allow_html=True)
+    show_metrics = st.checkbox("Show performance metrics")
+
+# Stage timings for the debug panel; recording is on only while some session has it open
+@st.cache_resource
+def metrics_sink():
+    return instrumentation.SubscribedSink(instrumentation.MemorySink())
+
+if 'session_key' not in st.session_state:
+    import uuid
+
+    st.session_state.session_key = uuid.uuid4().hex
+metrics_sink().subscribe(st.session_state.session_key, show_metrics)
+# Records from this session, including its background work, carry its key
+instrumentation.bind(session=st.session_state.session_key)
+
+def commit_company(company_name):
+    # Start the whole analysis as soon as a name is committed; the previous name is abandoned
+    prefetch = st.session_state.prefetch
+    # A finished run without a snapshot is restarted like a failed one
+    finished_empty = "saved" in st.session_state.prefetch_done and st.session_state.snapshot is None
+    if prefetch is not None and prefetch.company_name == company_name and not st.session_state.prefetch_error and not finished_empty:
+        return
+    if prefetch is not None:
+        prefetch.cancel()
+    from prefetch import Prefetch
+
+    # Callbacks run before the script binds the session, so the background work is tagged here
+    instrumentation.bind(session=st.session_state.session_key)
+    st.session_state.prefetch = Prefetch(company_name, STATEMENT_PATH).start()
+    st.session_state.company_name = company_name
+    st.session_state.market_report = ""
+    st.session_state.snapshot = None
+    st.session_state.prefetch_error = None
+    st.session_state.prefetch_done = set()
+    st.session_state.show_analysis = False
+
+def on_company_input():
+    # Pressing Enter in the field commits the name just like the button does
+    company_name = st.session_state.company_name_input.strip()
+    if company_name:
+        commit_company(company_name)
+        st.session_state.show_prompt = False
+
+def prefetch_result(name):
+    # A finished stage's result, or None; a failure is kept for the page to report
+    future = st.session_state.prefetch.results[name]
+    if not future.done():
+        return None
+    try:
+        return future.result()
+    except Exception as exc:
+        st.session_state.prefetch_error = str(exc)
+        return None
+
+def collect_prefetch():
+    # Pick up whatever the background analysis finished since the last rerun
+    prefetch = st.session_state.prefetch
+    if prefetch is None or prefetch.company_name != st.session_state.company_name:
+        return
+    done = st.session_state.prefetch_done
+    if "market_report" not in done and prefetch.results["market_report"].done():
+        done.add("market_report")
+        st.session_state.market_report = prefetch_result("market_report") or ""
+    if "saved" not in done and prefetch.results["saved"].done():
+        done.add("saved")
+        st.session_state.snapshot = prefetch_result("saved")
+
+@st.fragment(run_every=PREFETCH_POLL)
+def market_report_progress():
+    prefetch = st.session_state.prefetch
+    if prefetch.results["market_report"].done():
+        st.rerun()
+    st.markdown(prefetch.market_report.text or "Preparing the market report...")
+
+@st.fragment(run_every=PREFETCH_POLL)
+def analysis_progress():
+    prefetch = st.session_state.prefetch
+    if prefetch.done():
+        st.rerun()
+    ready = prefetch.ready()
+    st.progress(len(ready) / len(prefetch.results), text=f"{len(ready)} of {len(prefetch.results)} steps done")
+    if "averages" in ready:
+        averages = prefetch.results["averages"].result()
+        with st.expander("Industry Averages"):
+            st.dataframe(averages["quarterly_income"].style.format("${:,.2f}"))
+            st.dataframe(averages["metrics"].style.format("{:.2f}%"))
+    with st.expander("Financial Metrics", expanded=True):
+        st.markdown(prefetch.analysis.text or "Waiting for the industry averages...")
+
+collect_prefetch()
+
+def show_charts(data):
+    from charts import figures
+
+    # Drawn in the browser; the figures are dropped after this rerun
+    for fig in figures(data):
+        st.plotly_chart(fig, use_container_width=True)
+
+def show_snapshot(snapshot):
+    with st.expander("Industry Averages"):
+        st.dataframe(snapshot["quarterly_income"].style.format("${:,.2f}"))
+        st.dataframe(snapshot["metrics"].style.format("{:.2f}%"))
+    with st.expander("Financial Metrics", expanded=True):
+        st.markdown(snapshot["analysis"])
+    with st.expander("Visualizations"):
+        show_charts(snapshot["chart_data"])
 
 # Tabs for navigation
 tab1, tab2 = st.tabs(["Overview", "Analysis"])
@@ -190,15 +323,19 @@ with tab1:
     with col1:
         st.subheader("Company Information")
         st.write("Enter the company name")
-        company_name = st.text_input("Company Name", value=st.session_state.company_name, key="company_name_input", label_visibility="collapsed")
+        company_name = st.text_input("Company Name", value=st.session_state.company_name, key="company_name_input", label_visibility="collapsed", on_change=on_company_input)
         if st.button("Enter"):
+            company_name = company_name.strip()
             if not company_name:
+                if st.session_state.prefetch is not None:
+                    st.session_state.prefetch.cancel()
+                st.session_state.prefetch = None
                 st.session_state.show_prompt = True
                 st.session_state.company_name = ""
                 st.session_state.market_report = ""
             else:
-                st.session_state.company_name = company_name
-                st.session_state.market_report = generate_market_report_perplexity(company_name)
+                commit_company(company_name)
+                collect_prefetch()
                 st.session_state.show_prompt = False
         
         if st.session_state.show_prompt:
@@ -207,6 +344,15 @@ with tab1:
     with col2:
         st.image(overview_image, use_container_width=True)
     
+    if st.session_state.prefetch is not None and not st.session_state.market_report:
+        if st.session_state.prefetch_error:
+            st.error(f"The market report could not be generated: {st.session_state.prefetch_error}")
+        elif "market_report" in st.session_state.prefetch_done:
+            st.info("No market report was returned for this company.")
+        else:
+            # Shown as it streams in, then handed over to the styled block below
+            market_report_progress()
+
     if st.session_state.market_report:
         st.markdown("""
         <div class="market-report">
@@ -228,36 +374,61 @@ with tab2:
         st.image(finbot_image, width=500)  # Adjust the width as needed
         st.markdown('</div>', unsafe_allow_html=True)
     
+    snapshot = st.session_state.snapshot
+    if snapshot and snapshot["company"] != st.session_state.company_name:
+        snapshot = None
     if start_analysis:
         if not st.session_state.company_name:
             st.markdown('<p class="prompt-box">Enter a company name in Overview first.</p>', unsafe_allow_html=True)
-        elif not st.session_state.market_report:
-            st.markdown('<p class="prompt-box">Generate the market report in Overview first.</p>', unsafe_allow_html=True)
         else:
-            # Perform analysis
-            company_1_statement = 'data/original_data.csv'
-            with open(company_1_statement, 'r') as f:
-                company_1_statement_content = f.read()
-            
-            file_paths_companies_2_to_9 = [
-                'data/synthetic_data_1.csv',
-                'data/synthetic_data_5.csv',
-                'data/synthetic_data_6.csv',
-            ]
-            documents_companies_2_to_9 = [open(file, 'r').read() for file in file_paths_companies_2_to_9]
-            
-            industry_averages = calculate_averages_using_ai(documents_companies_2_to_9, st.session_state.company_name)
-            company_standing = analyze_company_standing(company_1_statement_content, industry_averages, st.session_state.market_report, st.session_state.company_name)
-            
-            with st.expander("Financial Metrics"):
-                st.markdown(company_standing, unsafe_allow_html=True)
-            
-            with st.expander("Visualizations"):
-                figures = generate_visualizations()
-                for fig in figures:
-                    st.pyplot(fig)
-            
-            with st.expander("Edit Information"):
-                edit_info = st.text_area("Changes", label_visibility="collapsed")
-                if st.button("Submit Changes"):
-                    st.success("Changes submitted successfully!")
+            # The analysis has been running since the name was entered
+            st.session_state.show_analysis = True
+
+    if st.session_state.show_analysis and st.session_state.company_name:
+        if snapshot:
+            # Keep the finished analysis on screen across reruns
+            show_snapshot(snapshot)
+        elif st.session_state.prefetch_error:
+            st.error(f"The analysis could not be completed: {st.session_state.prefetch_error}")
+        elif "saved" in st.session_state.prefetch_done:
+            st.warning("The analysis finished but could not be loaded. Press Enter in Overview to run it again.")
+        elif st.session_state.prefetch is not None:
+            analysis_progress()
+
+    if st.session_state.show_analysis and snapshot:
+        from financial_analysis import ANALYSIS_SECTIONS, nearest_peers
+        from snapshots import SnapshotStore, revise
+
+        notice = st.session_state.pop("edit_notice", None)
+        if notice:
+            st.success(notice)
+        with st.expander("Edit Information"):
+            edit_info = st.text_area("Changes", label_visibility="collapsed")
+            # Only the chosen sections are regenerated; the others come from the cache
+            sections = st.multiselect(
+                "Sections to update", list(ANALYSIS_SECTIONS), default=["highlights", "recommendations"],
+                format_func=lambda section: ANALYSIS_SECTIONS[section]["title"],
+            )
+            if st.button("Submit Changes"):
+                if edit_info.strip() and sections:
+                    with st.spinner("Updating the analysis..."):
+                        revised = revise(snapshot, {section: edit_info.strip() for section in sections}, STATEMENT_PATH, nearest_peers(STATEMENT_PATH))
+                        store = SnapshotStore()
+                        store.save(snapshot["company"], snapshot["fingerprint"], revised)
+                        st.session_state.snapshot = store.load(snapshot["company"], snapshot["fingerprint"])
+                    st.session_state.edit_notice = "Changes submitted successfully!"
+                    st.rerun()
+                else:
+                    st.markdown('<p class="prompt-box">Describe the changes and pick at least one section.</p>', unsafe_allow_html=True)
+
+if show_metrics:
+    with st.expander("Performance Metrics", expanded=True):
+        # The sink is shared; each panel shows only its own session's records
+        records = [record for record in metrics_sink().sink.records if record.get("session") == st.session_state.session_key]
+        if records:
+            st.dataframe(records[::-1], use_container_width=True)
+        else:
+            st.write("No stages recorded yet.")
+
+# Whole-script time for this rerun, shown in the panel on the next one
+instrumentation.emit("app_rerun", time.perf_counter() - rerun_started)
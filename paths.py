@@ -0,0 +1,8 @@
+import os
+
+# Data and caches live next to the code, so the app works from any working directory
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(PACKAGE_DIR, "data")
+CACHE_DIR = os.path.join(PACKAGE_DIR, ".cache")
+# The statement the app analyzes
+STATEMENT_PATH = os.path.join(DATA_DIR, "original_data.csv")
@@ -0,0 +1,111 @@
+import functools
+import glob
+import os
+
+import numpy as np
+
+from paths import DATA_DIR
+from periods import periods_for
+from statement import load_statement
+
+# Canonical sales channels and the text that identifies them in account names
+CHANNELS = {
+    "Shopify": "Shopify",
+    "Amazon": "Amazon",
+    "Faire": "Faire",
+    "Invoices": "Invoices",
+}
+FEATURE_NAMES = (
+    ["Revenue Scale (log10)"]
+    + [f"{channel} Share" for channel in CHANNELS]
+    + ["Gross Margin", "Net Margin", "Expense Ratio"]
+    + [f"Q{i} Revenue Share" for i in range(1, 5)]
+)
+
+
+def channel_sales(statement):
+    # CHANNELS x months product sales
+    sales = np.zeros((len(CHANNELS), len(statement.months)))
+    for account in statement.accounts:
+        if not account.name.startswith("Income.") or "Sales of Product Income - " not in account.label:
+            continue
+        for i, marker in enumerate(CHANNELS.values()):
+            if marker in account.label:
+                sales[i] += statement[account.key]
+    return sales
+
+
+def statement_features(statement_path):
+    # Everything over the trailing twelve months, so histories of any length compare
+    statement = load_statement(statement_path)
+    periods = periods_for(statement.months)
+    gross_profit, net_profit, expenses = periods.window(statement.lines(["Gross Profit", "Net Profit", "Total Expenses"]))
+    annual_income = periods.window(statement["Total Income"])
+
+    sales = periods.window(channel_sales(statement))
+    channel_mix = sales / sales.sum() if sales.sum() else sales
+
+    margins = [gross_profit / annual_income, net_profit / annual_income, -expenses / annual_income]
+    seasonality = periods.quarter_of_year(statement["Total Income"]) / annual_income
+    return np.concatenate([[np.log10(max(annual_income, 1.0))], channel_mix, margins, seasonality])
+
+
+class PeerIndex:
+    def __init__(self, statement_paths, use_tree=False):
+        self.paths = list(statement_paths)
+        features = np.vstack([statement_features(path) for path in self.paths])
+        # Standardize so every feature carries the same weight
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        self.vectors = (features - self.mean) / self.scale
+        self.tree = None
+        if use_tree:
+            try:
+                from scipy.spatial import cKDTree
+            except ImportError:
+                pass
+            else:
+                self.tree = cKDTree(self.vectors)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def query(self, statement_path, k=3, exclude=()):
+        # The k most similar statements as (path, distance), nearest first
+        target = (statement_features(statement_path) - self.mean) / self.scale
+        excluded = {os.path.abspath(path) for path in (statement_path, *exclude)}
+        allowed = np.array([os.path.abspath(path) not in excluded for path in self.paths])
+        k = min(k, int(allowed.sum()))
+        if k == 0:
+            return []
+        if self.tree is not None:
+            distances, indices = self.tree.query(target, k=min(k + len(self.paths) - int(allowed.sum()), len(self.paths)))
+            pairs = [(i, d) for i, d in zip(np.atleast_1d(indices), np.atleast_1d(distances)) if allowed[i]]
+            return [(self.paths[i], float(d)) for i, d in pairs[:k]]
+        distances = np.linalg.norm(self.vectors - target, axis=1)
+        distances[~allowed] = np.inf
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(self.paths[i], float(distances[i])) for i in nearest]
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_index(files, use_tree):
+    return PeerIndex([path for path, _, _ in files], use_tree=use_tree)
+
+
+def build_index(statement_paths, use_tree=False):
+    # Rebuilt only when one of the files changes
+    files = []
+    for path in statement_paths:
+        stat = os.stat(path)
+        files.append((path, stat.st_mtime_ns, stat.st_size))
+    return _cached_index(tuple(files), use_tree)
+
+
+def select_peers(statement_path, candidates=os.path.join(DATA_DIR, "*.csv"), k=3):
+    # Paths of the k statements most comparable to statement_path
+    paths = sorted(glob.glob(candidates)) if isinstance(candidates, str) else list(candidates)
+    index = build_index(paths)
+    return [path for path, _ in index.query(statement_path, k=k)]
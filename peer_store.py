@@ -0,0 +1,120 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from paths import DATA_DIR
+from periods import parse_month
+from statement import load_statement
+
+# Parquet dataset of statement lines, partitioned by company and year
+PEER_STORE = os.environ.get("PEER_STORE", os.path.join(DATA_DIR, "peer_store"))
+
+SCHEMA = pa.schema([
+    ("company", pa.string()),
+    ("year", pa.int16()),
+    ("month", pa.date32()),
+    ("account", pa.string()),
+    ("depth", pa.int8()),
+    ("value", pa.float64()),
+])
+PARTITIONING = ds.partitioning(
+    pa.schema([("company", pa.string()), ("year", pa.int16())]), flavor="hive"
+)
+
+
+def statement_table(statement_path, company):
+    # Long format: one row per account and month
+    statement = load_statement(statement_path)
+    months = pd.Series(np.array([parse_month(label) for label in statement.months]).astype("datetime64[ns]"))
+    n_months, n_accounts = statement.values.shape
+    return pa.table({
+        "company": pa.array([company] * (n_months * n_accounts), pa.string()),
+        "year": pa.array(np.repeat(months.dt.year.to_numpy(), n_accounts), pa.int16()),
+        "month": pa.array(np.repeat(months.dt.date.to_numpy(), n_accounts), pa.date32()),
+        "account": pa.array([account.key for account in statement.accounts] * n_months, pa.string()),
+        "depth": pa.array([account.depth for account in statement.accounts] * n_months, pa.int8()),
+        "value": pa.array(statement.values.ravel(), pa.float64()),
+    }, schema=SCHEMA)
+
+
+def ingest(statement_paths, store_dir=PEER_STORE, companies=None):
+    # Re-ingesting a company replaces its partitions for the years in the new data
+    companies = companies or [os.path.splitext(os.path.basename(path))[0] for path in statement_paths]
+    table = pa.concat_tables([statement_table(path, company) for path, company in zip(statement_paths, companies)])
+    ds.write_dataset(
+        table,
+        store_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        basename_template="part-{i}.parquet",
+    )
+    return companies
+
+
+def open_store(store_dir=PEER_STORE):
+    return ds.dataset(
+        store_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def list_companies(store_dir=PEER_STORE):
+    # Read from the partition directories only
+    dataset = open_store(store_dir)
+    expressions = [ds.get_partition_keys(fragment.partition_expression) for fragment in dataset.get_fragments()]
+    return sorted({keys["company"] for keys in expressions})
+
+
+class PeerQuery:
+    # A peer set read from the columnar store instead of individual CSVs
+    def __init__(self, store_dir=PEER_STORE, companies=None, year=None):
+        self.store_dir = store_dir
+        self.companies = sorted(companies) if companies else list_companies(store_dir)
+        self.year = year
+
+    def __repr__(self):
+        return f"PeerQuery({self.store_dir!r}, companies={self.companies!r}, year={self.year!r})"
+
+    def __len__(self):
+        return len(self.companies)
+
+    def lines(self, accounts):
+        # peers x accounts x months array, reading only the needed columns and rows
+        condition = pc.field("company").isin(self.companies) & pc.field("account").isin(accounts)
+        if self.year is not None:
+            condition &= pc.field("year") == self.year
+        table = open_store(self.store_dir).to_table(columns=["company", "month", "account", "value"], filter=condition)
+
+        months = np.unique(table["month"].to_numpy())
+        company_index = {company: i for i, company in enumerate(self.companies)}
+        account_index = {account: i for i, account in enumerate(accounts)}
+        values = np.full((len(self.companies), len(accounts), len(months)), np.nan)
+        values[
+            [company_index[c] for c in table["company"].to_pylist()],
+            [account_index[a] for a in table["account"].to_pylist()],
+            np.searchsorted(months, table["month"].to_numpy()),
+        ] = table["value"].to_numpy()
+        labels = [pd.Timestamp(month).strftime("%b %Y") for month in months]
+        return values, labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load statement CSVs into the columnar peer store.")
+    parser.add_argument("statements", nargs="+", help="statement CSVs to ingest")
+    parser.add_argument("--store", default=PEER_STORE, help="peer store directory")
+    args = parser.parse_args(argv)
+    companies = ingest(args.statements, args.store)
+    print(f"Ingested {len(companies)} statements into {args.store}")
+
+
+if __name__ == "__main__":
+    main()
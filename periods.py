@@ -0,0 +1,196 @@
+import functools
+import os
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Month column headers the statements use, e.g. "Jan 2024"
+MONTH_FORMATS = ("%b %Y", "%B %Y", "%Y-%m", "%b-%y", "%b %y", "%m/%Y")
+MONTH_NAMES = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+# Months in the trailing window the headline metrics are computed over
+WINDOW = 12
+
+
+def parse_month(label):
+    for fmt in MONTH_FORMATS:
+        try:
+            parsed = datetime.strptime(label.strip(), fmt)
+        except ValueError:
+            continue
+        return np.datetime64(f"{parsed.year:04d}-{parsed.month:02d}", "M")
+    raise ValueError(f"unrecognised month column {label!r}")
+
+
+def month_label(month):
+    return month.astype(datetime).strftime("%b %Y")
+
+
+class FiscalCalendar:
+    # start_month is the first month of the fiscal year; 1 means the calendar year.
+    # Other fiscal years are named after the calendar year they end in.
+    def __init__(self, start_month=1):
+        if not 1 <= start_month <= 12:
+            raise ValueError(f"fiscal year start month must be 1-12, got {start_month}")
+        self.start_month = start_month
+
+    def __repr__(self):
+        return f"FiscalCalendar({self.start_month})"
+
+    def __eq__(self, other):
+        return isinstance(other, FiscalCalendar) and other.start_month == self.start_month
+
+    def __hash__(self):
+        return hash(self.start_month)
+
+    @classmethod
+    def from_env(cls):
+        # FISCAL_YEAR_START=7 or FISCAL_YEAR_START=Jul
+        value = os.environ.get("FISCAL_YEAR_START", "1").strip()
+        if value.isdigit():
+            return cls(int(value))
+        return cls(MONTH_NAMES.index(value[:3].lower()) + 1)
+
+    def fiscal(self, months):
+        # (fiscal year, fiscal quarter 1-4) arrays for datetime64[M] months
+        shifted = months.astype("int64") - (self.start_month - 1)
+        year = shifted // 12 + 1970 + (self.start_month != 1)
+        return year, shifted % 12 // 3 + 1
+
+    def quarter_label(self, year, quarter):
+        return f"Q{quarter} {year}" if self.start_month == 1 else f"Q{quarter} FY{year}"
+
+    def year_label(self, year):
+        return str(year) if self.start_month == 1 else f"FY{year}"
+
+
+DEFAULT_CALENDAR = FiscalCalendar.from_env()
+
+
+def growth(series, lag):
+    # Percent change against the value lag steps earlier along the last axis; NaN where there is none
+    result = np.full(series.shape, np.nan)
+    if series.shape[-1] > lag:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[..., lag:] = (series[..., lag:] - series[..., :-lag]) / series[..., :-lag] * 100
+    return result
+
+
+class Periods:
+    # Period structure of a set of month columns. Everything works on the last axis of
+    # arrays with one column per month header, so a whole peers x lines x months block
+    # is handled in one call; months missing from the headers are treated as NaN.
+    def __init__(self, labels, calendar=None):
+        self.labels = list(labels)
+        self.calendar = calendar or DEFAULT_CALENDAR
+        months = np.array([parse_month(label) for label in self.labels], dtype="datetime64[M]")
+        if len(months) == 0:
+            raise ValueError("statement has no month columns")
+        if len(np.unique(months)) != len(months):
+            raise ValueError("statement has duplicate month columns")
+        self.months = months
+        # Contiguous monthly grid from the first to the last header
+        self.grid = np.arange(months.min(), months.max() + 1)
+        self.positions = (months - self.grid[0]).astype("int64")
+        present = np.zeros(len(self.grid), dtype=bool)
+        present[self.positions] = True
+        self.fiscal_year, self.fiscal_quarter = self.calendar.fiscal(self.grid)
+
+        # Quarters and fiscal years whose months are all present, as grid indices
+        quarter_key = self.fiscal_year * 4 + self.fiscal_quarter - 1
+        self.quarter_keys, self.quarter_months = self._complete(quarter_key, present, 3)
+        self.quarters = [self.calendar.quarter_label(key // 4, key % 4 + 1) for key in self.quarter_keys]
+        self.year_keys, self.year_months = self._complete(self.fiscal_year, present, 12)
+        self.years = [self.calendar.year_label(year) for year in self.year_keys]
+
+        # The trailing window the headline metrics use, and the quarters inside it
+        self.window_months = np.arange(max(len(self.grid) - WINDOW, 0), len(self.grid))
+        self.window_quarters = np.flatnonzero(self.quarter_months.min(axis=1) >= self.window_months[0]) \
+            if len(self.quarter_keys) else np.arange(0)
+
+    @staticmethod
+    def _complete(keys, present, size):
+        unique = np.unique(keys)
+        groups = [np.flatnonzero(keys == key) for key in unique]
+        complete = [(key, group) for key, group in zip(unique, groups) if len(group) == size and present[group].all()]
+        if not complete:
+            return np.zeros(0, dtype="int64"), np.zeros((0, size), dtype="int64")
+        return np.array([key for key, _ in complete]), np.stack([group for _, group in complete])
+
+    @classmethod
+    def union(cls, label_lists, calendar=None):
+        # Periods spanning every month that appears in any of the header lists
+        months = sorted({parse_month(label) for labels in label_lists for label in labels})
+        return cls([month_label(month) for month in months], calendar)
+
+    @property
+    def grid_labels(self):
+        return [month_label(month) for month in self.grid]
+
+    @property
+    def window_label(self):
+        # Name of the headline period: the fiscal year if it is exactly one, else TTM or its length
+        if len(self.window_months) == WINDOW and len(self.year_keys) and (self.year_months[-1] == self.window_months).all():
+            return self.years[-1]
+        return "TTM" if len(self.window_months) == WINDOW else f"{len(self.window_months)} Months"
+
+    def to_grid(self, values):
+        # Header columns placed on the contiguous grid; grid-shaped input is returned as is
+        if values.shape[-1] == len(self.grid):
+            return np.asarray(values, dtype="float64")
+        result = np.full(values.shape[:-1] + (len(self.grid),), np.nan)
+        result[..., self.positions] = values
+        return result
+
+    def align(self, values, labels):
+        # Values with other month headers moved onto this grid; months outside it are dropped
+        months = np.array([parse_month(label) for label in labels], dtype="datetime64[M]")
+        inside = (months >= self.grid[0]) & (months <= self.grid[-1])
+        result = np.full(values.shape[:-1] + (len(self.grid),), np.nan)
+        result[..., (months[inside] - self.grid[0]).astype("int64")] = values[..., inside]
+        return result
+
+    def quarterly(self, values):
+        # Sums for each complete quarter
+        return self.to_grid(values)[..., self.quarter_months].sum(axis=-1)
+
+    def window(self, values):
+        # Sum over the trailing window
+        return self.to_grid(values)[..., self.window_months].sum(axis=-1)
+
+    def rolling(self, values, months):
+        # Trailing sums over the given number of months, one per grid month; NaN until the window is full
+        grid = self.to_grid(values)
+        result = np.full(grid.shape, np.nan)
+        if grid.shape[-1] >= months:
+            result[..., months - 1:] = sliding_window_view(grid, months, axis=-1).sum(axis=-1)
+        return result
+
+    def ttm(self, values):
+        return self.rolling(values, 12)
+
+    def quarterly_yoy(self, values):
+        # Growth of each complete quarter against the same quarter a year earlier
+        quarterly = self.quarterly(values)
+        result = np.full(quarterly.shape, np.nan)
+        previous = np.searchsorted(self.quarter_keys, self.quarter_keys - 4)
+        found = (previous < len(self.quarter_keys)) & (self.quarter_keys[np.minimum(previous, len(self.quarter_keys) - 1)] == self.quarter_keys - 4)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[..., found] = (quarterly[..., found] - quarterly[..., previous[found]]) / quarterly[..., previous[found]] * 100
+        return result
+
+    def quarter_of_year(self, values):
+        # Trailing-window sums by fiscal quarter number, Q1..Q4 on the last axis
+        window = self.to_grid(values)[..., self.window_months]
+        quarters = self.fiscal_quarter[self.window_months]
+        return np.stack([window[..., quarters == q].sum(axis=-1) for q in range(1, 5)], axis=-1)
+
+
+@functools.lru_cache(maxsize=256)
+def _periods(labels, calendar):
+    return Periods(labels, calendar)
+
+
+def periods_for(labels, calendar=None):
+    # Shared Periods for a header list; statements with the same columns reuse one
+    return _periods(tuple(labels), calendar or DEFAULT_CALENDAR)
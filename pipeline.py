@@ -0,0 +1,67 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class StageError(Exception):
+    def __init__(self, stage, message):
+        super().__init__(f"Stage '{stage}' failed: {message}")
+        self.stage = stage
+
+
+class StageTimeout(StageError):
+    pass
+
+
+def run_stages(stages, timeouts=None, max_workers=None, on_result=None):
+    # stages maps a name to (func, dependencies); each func is called with the
+    # results of its dependencies, in order, as soon as they are all available.
+    # on_result(name, value) is called as each stage finishes.
+    timeouts = timeouts or {}
+    for name, (_, deps) in stages.items():
+        missing = [dep for dep in deps if dep not in stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+
+    results = {}
+    running = {}
+    started = {}
+    pending = dict(stages)
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages))
+    try:
+        while pending or running:
+            # Start every stage whose dependencies have finished
+            for name, (func, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    # Each stage runs in a copy of the caller's context (instrumentation scope)
+                    running[executor.submit(contextvars.copy_context().run, func, *[results[dep] for dep in deps])] = name
+                    started[name] = time.monotonic()
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Stages have circular dependencies: {sorted(pending)}")
+
+            # Wake up for the first finished stage or the nearest deadline
+            now = time.monotonic()
+            deadlines = [started[name] + timeouts[name] for name in running.values() if name in timeouts]
+            timeout = max(min(deadlines) - now, 0) if deadlines else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as exc:
+                    raise StageError(name, exc) from exc
+                if on_result is not None:
+                    on_result(name, results[name])
+
+            now = time.monotonic()
+            for name in running.values():
+                if name in timeouts and now - started[name] >= timeouts[name]:
+                    raise StageTimeout(name, f"timed out after {timeouts[name]}s")
+    finally:
+        # Cancel anything not yet started; running threads are abandoned
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
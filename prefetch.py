@@ -0,0 +1,210 @@
+import contextlib
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+import charts
+import financial_analysis as fa
+from paths import STATEMENT_PATH
+from pipeline import run_stages
+from snapshots import SnapshotStore, assemble, data_fingerprint
+
+class Cancelled(Exception):
+    pass
+
+
+class TextBuffer:
+    # Text streamed so far by a background stage; the UI reads it while it grows
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parts = []
+
+    def append(self, text):
+        with self.lock:
+            self.parts.append(text)
+
+    @property
+    def text(self):
+        with self.lock:
+            return "".join(self.parts)
+
+
+class SectionBuffers:
+    # Analysis sections streaming in parallel, read back in order: the text runs up to
+    # the first section that is still streaming
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sections = {section: TextBuffer() for section in fa.ANALYSIS_SECTIONS}
+        self.finished = set()
+        self.whole = None
+
+    def finish(self, section):
+        with self.lock:
+            self.finished.add(section)
+
+    def replace(self, text):
+        # The whole analysis at once, e.g. from a snapshot or after verification
+        with self.lock:
+            self.whole = text
+
+    @property
+    def text(self):
+        with self.lock:
+            if self.whole is not None:
+                return self.whole
+            finished = set(self.finished)
+        parts = []
+        for section, buffer in self.sections.items():
+            parts.append(buffer.text)
+            if section not in finished:
+                break
+        return fa.SECTION_SEPARATOR.join(part for part in parts if part)
+
+
+class Prefetch:
+    # Runs the whole analysis for one company in the background. Every stage result
+    # is published as a Future the moment it is ready, and the market report and the
+    # analysis sections grow in text buffers, so callers can show partial progress. An existing snapshot
+    # short-circuits everything; a snapshot is saved at the end otherwise. Each Prefetch
+    # has its own driver thread, so a new session never queues behind other sessions'
+    # analyses; upstream load is bounded by the rate limiters in http_clients.
+    def __init__(self, company_name, statement_path=STATEMENT_PATH, store=None):
+        self.company_name = company_name
+        self.statement_path = statement_path
+        self.store = store or SnapshotStore()
+        self.fingerprint = None
+        self.cancelled = threading.Event()
+        self.market_report = TextBuffer()
+        self.analysis = SectionBuffers()
+        self.stages = {
+            "peers": (self._peers, []),
+            "snapshot": (self._snapshot, ["peers"]),
+            "market_report": (self._market_report, ["snapshot"]),
+            "averages": (fa.calculate_industry_averages, ["peers"]),
+            "industry_averages": (self._industry_averages, ["peers", "snapshot"]),
+            "company_statement": (self._company_statement, ["snapshot"]),
+            "chart_data": (self._chart_data, ["peers", "snapshot"]),
+            # One stage per analysis section, each waiting only for its own inputs
+            **{
+                section: (functools.partial(self._section, section), ["snapshot", *spec["inputs"]])
+                for section, spec in fa.ANALYSIS_SECTIONS.items()
+            },
+            "analysis": (self._analysis, ["peers", "snapshot", *fa.ANALYSIS_SECTIONS]),
+            "saved": (self._save, ["snapshot", "market_report", "industry_averages", "company_statement", "analysis", "averages", "chart_data"]),
+        }
+        self.results = {name: Future() for name in self.stages}
+        self.driver = None
+
+    def __repr__(self):
+        return f"Prefetch({self.company_name!r}, done={self.done()})"
+
+    def start(self):
+        self.driver = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run,), name=f"prefetch-{self.company_name}", daemon=True
+        )
+        self.driver.start()
+        return self
+
+    def cancel(self):
+        # LLM stages that have not started are skipped; a running LLM stream is no longer read
+        # but still finishes into the cache
+        self.cancelled.set()
+        for future in self.results.values():
+            future.cancel()
+
+    def done(self):
+        return self.results["saved"].done()
+
+    def ready(self):
+        # Names of the stages that have finished successfully
+        return [
+            name for name, future in self.results.items()
+            if future.done() and not future.cancelled() and future.exception() is None
+        ]
+
+    def _publish(self, name, value):
+        with contextlib.suppress(InvalidStateError):
+            self.results[name].set_result(value)
+
+    def _run(self):
+        try:
+            run_stages(self.stages, timeouts=fa.STAGE_TIMEOUTS, on_result=self._publish)
+        except Exception as exc:
+            for future in self.results.values():
+                with contextlib.suppress(InvalidStateError):
+                    future.set_exception(exc)
+
+    def _check(self):
+        if self.cancelled.is_set():
+            raise Cancelled(self.company_name)
+
+    def _stream(self, chunks, buffer):
+        with contextlib.closing(chunks):
+            for text in chunks:
+                self._check()
+                buffer.append(text)
+        return buffer.text
+
+    def _peers(self):
+        self._check()
+        return fa.nearest_peers(self.statement_path)
+
+    def _snapshot(self, peers):
+        self.fingerprint = data_fingerprint(self.statement_path, peers)
+        return self.store.load(self.company_name, self.fingerprint)
+
+    def _market_report(self, snapshot):
+        if snapshot is not None:
+            self.market_report.append(snapshot["market_report"])
+            return snapshot["market_report"]
+        self._check()
+        return self._stream(fa.stream_market_report(self.company_name), self.market_report)
+
+    def _industry_averages(self, peers, snapshot):
+        if snapshot is not None:
+            return snapshot["industry_averages"]
+        self._check()
+        return fa.calculate_averages_using_ai(peers, self.company_name)
+
+    def _company_statement(self, snapshot):
+        if snapshot is not None:
+            return snapshot["company_statement"]
+        return fa.build_statement_summary(self.statement_path)[0]
+
+    def _chart_data(self, peers, snapshot):
+        if snapshot is not None:
+            return snapshot["chart_data"]
+        return charts.chart_data(self.statement_path, peers)
+
+    def _section(self, section, snapshot, *values):
+        if snapshot is not None:
+            return None
+        self._check()
+        inputs = dict(zip(fa.ANALYSIS_SECTIONS[section]["inputs"], values))
+        text = self._stream(fa.stream_section(section, inputs, self.company_name), self.analysis.sections[section])
+        self.analysis.finish(section)
+        return text
+
+    def _analysis(self, peers, snapshot, *sections):
+        if snapshot is not None:
+            self.analysis.replace(snapshot["analysis"])
+            return snapshot["analysis"]
+        analysis = fa.verify_analysis(fa.join_sections(dict(zip(fa.ANALYSIS_SECTIONS, sections))), self.statement_path, peers)[0]
+        self.analysis.replace(analysis)
+        return analysis
+
+    def _save(self, snapshot, market_report, industry_averages, company_statement, analysis, averages, chart_data):
+        if snapshot is not None:
+            return snapshot
+        results = {
+            "market_report": market_report,
+            "industry_averages": industry_averages,
+            "company_statement": company_statement,
+            "analysis": analysis,
+        }
+        bundle = assemble(results, averages, chart_data)
+        self.store.save(self.company_name, self.fingerprint, bundle)
+        # The bundle is already in snapshot form if a concurrent save replaced the files meanwhile
+        snapshot = self.store.load(self.company_name, self.fingerprint)
+        return snapshot or {**bundle, "company": self.company_name, "fingerprint": self.fingerprint}
@@ -0,0 +1,179 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import charts
+import financial_analysis as fa
+from aggregates import file_fingerprint
+from instrumentation import instrumented
+from llm_cache import make_key
+from paths import CACHE_DIR, STATEMENT_PATH
+
+# Finished analyses, served until one of the input statements changes
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(CACHE_DIR, "snapshots"))
+# Bump when the bundle layout changes so older snapshots are ignored
+SNAPSHOT_VERSION = 3
+# Bundle fields stored as DataFrames
+FRAMES = ("quarterly_income", "metrics")
+
+
+def input_files(statement_path, peers):
+    # Every statement file the analysis reads
+    if hasattr(peers, "store_dir"):  # peer_store.PeerQuery
+        peer_paths = sorted(glob.glob(os.path.join(peers.store_dir, "**", "*.parquet"), recursive=True))
+    elif hasattr(peers, "peers"):  # aggregates.IndustryAggregate
+        peer_paths = sorted(peer["path"] for peer in peers.peers.values())
+    else:
+        peer_paths = sorted(peers)
+    return [statement_path, *peer_paths]
+
+
+def data_fingerprint(statement_path, peers):
+    # Content hash, so touching a file without changing it keeps the snapshot
+    parts = [file_fingerprint(path) for path in input_files(statement_path, peers)]
+    if hasattr(peers, "store_dir"):
+        parts += [peers.companies, peers.year]
+    return make_key(version=SNAPSHOT_VERSION, inputs=parts)
+
+
+def assemble(results, averages, chart_data):
+    # results as returned by financial_analysis.run_analysis, including "analysis"
+    return {
+        "market_report": results["market_report"],
+        "industry_averages": results["industry_averages"],
+        "company_statement": results["company_statement"],
+        "analysis": results["analysis"],
+        "quarterly_income": averages["quarterly_income"],
+        "metrics": averages["metrics"],
+        # charts.chart_data output; the figures are rebuilt from it when shown
+        "chart_data": chart_data,
+    }
+
+
+@instrumented("build_snapshot")
+def build_snapshot(company_name, statement_path=STATEMENT_PATH, peers=fa.PEER_FILES, market_report=None):
+    results = fa.run_analysis(company_name, statement_path=statement_path, peers=peers, market_report=market_report)
+    return assemble(results, fa.calculate_industry_averages(peers), charts.chart_data(statement_path, peers))
+
+
+@instrumented("revise_snapshot")
+def revise(snapshot, corrections, statement_path=STATEMENT_PATH, peers=fa.PEER_FILES):
+    # Snapshot with corrections ({section: text}) added to any earlier ones. Only the
+    # analysis sections whose corrections changed are regenerated; the rest are cached.
+    merged = dict(snapshot.get("corrections", {}))
+    for section, text in corrections.items():
+        merged[section] = f"{merged[section]}\n{text}" if merged.get(section) else text
+    analysis = fa.analyze_company_standing(
+        snapshot["company_statement"], snapshot["industry_averages"], snapshot["market_report"], snapshot["company"],
+        corrections=merged,
+    )
+    return {**snapshot, "corrections": merged, "analysis": fa.verify_analysis(analysis, statement_path, peers)[0]}
+
+
+class SnapshotStore:
+    # One snapshot.json per company and data fingerprint
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+
+    def _company_dir(self, company_name):
+        return os.path.join(self.directory, make_key(company=company_name.strip().casefold())[:32])
+
+    def path(self, company_name, fingerprint):
+        return os.path.join(self._company_dir(company_name), fingerprint)
+
+    def load(self, company_name, fingerprint):
+        path = self.path(company_name, fingerprint)
+        try:
+            with open(os.path.join(path, "snapshot.json")) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            # Missing, or pruned by a newer snapshot while we were reading
+            return None
+        snapshot["company"] = company_name
+        for field in FRAMES:
+            snapshot[field] = pd.DataFrame(**snapshot[field])
+        snapshot["chart_data"] = {name: pd.DataFrame(**frame) for name, frame in snapshot["chart_data"].items()}
+        return snapshot
+
+    def save(self, company_name, fingerprint, bundle):
+        company_dir = self._company_dir(company_name)
+        os.makedirs(company_dir, exist_ok=True)
+        # Built in a staging directory and renamed, so readers never see half a snapshot
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=company_dir)
+        state = {
+            **bundle,
+            **{field: bundle[field].to_dict(orient="split") for field in FRAMES},
+            "chart_data": {name: frame.to_dict(orient="split") for name, frame in bundle["chart_data"].items()},
+            "company": company_name,
+            "fingerprint": fingerprint,
+            "created_at": time.time(),
+        }
+        with open(os.path.join(staging, "snapshot.json"), "w") as f:
+            json.dump(state, f, default=float)
+        target = self.path(company_name, fingerprint)
+        shutil.rmtree(target, ignore_errors=True)
+        try:
+            os.replace(staging, target)
+        except OSError:
+            # Another process saved the same snapshot first
+            shutil.rmtree(staging, ignore_errors=True)
+        self._prune(company_dir, keep=fingerprint)
+
+    def _prune(self, company_dir, keep):
+        # Snapshots built from older data can never match again
+        for name in os.listdir(company_dir):
+            if name != keep and not name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(company_dir, name), ignore_errors=True)
+
+    def get_or_build(self, company_name, statement_path=STATEMENT_PATH, peers=fa.PEER_FILES):
+        fingerprint = data_fingerprint(statement_path, peers)
+        snapshot = self.load(company_name, fingerprint)
+        if snapshot is None:
+            self.save(company_name, fingerprint, build_snapshot(company_name, statement_path, peers))
+            snapshot = self.load(company_name, fingerprint)
+        return snapshot
+
+
+def prewarm(companies, statement_path=STATEMENT_PATH, peers=fa.PEER_FILES, store=None, workers=4):
+    # Builds any missing snapshots; returns {company: error or None}
+    store = store or SnapshotStore()
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(store.get_or_build, company, statement_path, peers): company for company in companies}
+        for future in as_completed(futures):
+            company = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                outcomes[company] = repr(exc)
+                print(f"{company}: snapshot failed: {exc}", file=sys.stderr)
+            else:
+                outcomes[company] = None
+                print(f"{company}: snapshot ready", file=sys.stderr)
+    return outcomes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build analysis snapshots so the app can serve them instantly.")
+    parser.add_argument("companies", nargs="+", help="company names to pre-warm")
+    parser.add_argument("--statement", default=STATEMENT_PATH, help="statement CSV to analyze")
+    parser.add_argument("--peers", nargs="+", help="peer statements (default: the app's nearest-peer group)")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="where snapshots are stored")
+    parser.add_argument("--workers", type=int, default=4, help="companies built concurrently")
+    args = parser.parse_args(argv)
+
+    peers = args.peers or fa.nearest_peers(args.statement)
+    outcomes = prewarm(args.companies, args.statement, peers, SnapshotStore(args.snapshot_dir), args.workers)
+    sys.exit(1 if any(outcomes.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+# Each hierarchy level in the Name column is indented by four spaces
+INDENT = 4
+# Summary lines every statement is expected to have
+KEY_LINES = ["Total Income", "Total Cost Of Goods Sold", "Gross Profit", "Total Expenses", "Net Profit"]
+
+
+class Account:
+    __slots__ = ("key", "name", "label", "depth", "column", "parent", "children")
+
+    def __init__(self, key, name, depth, column, parent):
+        self.key = key
+        self.name = name
+        # Last segment of the dotted path, e.g. "Sales of Product Income - Shopify"
+        self.label = name.split(".")[-1]
+        self.depth = depth
+        self.column = column
+        self.parent = parent
+        self.children = []
+
+    def __repr__(self):
+        return f"Account({self.key!r}, depth={self.depth})"
+
+
+class Statement:
+    def __init__(self, df, path=None):
+        self.path = path
+        self.months = [c for c in df.columns if c not in ("Name", "Total")]
+        # months x accounts, in the row order of the CSV
+        self.values = np.ascontiguousarray(df[self.months].to_numpy(dtype="float64").T)
+        self.accounts = []
+        self.index = {}
+        stack = []
+        for column, raw_name in enumerate(df["Name"]):
+            name = raw_name.strip()
+            depth = (len(raw_name) - len(raw_name.lstrip(" "))) // INDENT
+            while stack and stack[-1].depth >= depth:
+                stack.pop()
+            parent = stack[-1] if stack else None
+            # A few account names repeat in different branches; later copies get a suffix
+            key = name
+            copy = 2
+            while key in self.index:
+                key = f"{name} ({copy})"
+                copy += 1
+            account = Account(key, name, depth, column, parent)
+            if parent is not None:
+                parent.children.append(account)
+            self.accounts.append(account)
+            self.index[key] = account
+            stack.append(account)
+        # Parent lines can carry postings of their own on top of their children,
+        # so keep the amount booked directly on each account as well
+        self.own_values = self.values.copy()
+        for account in self.accounts:
+            if account.parent is not None:
+                self.own_values[:, account.parent.column] -= self.values[:, account.column]
+        self._subtrees = {}
+
+    @property
+    def roots(self):
+        return [account for account in self.accounts if account.parent is None]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        # Monthly values for one account as reported in the statement
+        return self.values[:, self.index[key].column]
+
+    def account(self, key):
+        return self.index[key]
+
+    def lines(self, keys):
+        # accounts x months array for the given account keys
+        return self.values[:, [self.index[key].column for key in keys]].T
+
+    def subtree(self, key):
+        # Columns of key and every account below it
+        if key not in self._subtrees:
+            found = []
+            pending = [self.index[key]]
+            while pending:
+                account = pending.pop()
+                found.append(account.column)
+                pending.extend(account.children)
+            self._subtrees[key] = np.array(sorted(found), dtype=np.intp)
+        return self._subtrees[key]
+
+    def rollup(self, key):
+        # Monthly totals rebuilt from the amounts booked directly in the subtree
+        return self.own_values[:, self.subtree(key)].sum(axis=1)
+
+    def drilldown(self, key):
+        # Direct children of key as a DataFrame of monthly values
+        children = self.index[key].children
+        return pd.DataFrame(
+            self.values[:, [child.column for child in children]].T,
+            index=[child.key for child in children],
+            columns=self.months,
+        )
+
+    def to_frame(self):
+        return pd.DataFrame(self.values.T, index=list(self.index), columns=self.months)
+
+
+@functools.lru_cache(maxsize=256)
+@instrumented("parse_statement")
+def _load_statement(path, mtime_ns, size):
+    return Statement(pd.read_csv(path), path=path)
+
+
+def load_statement(path):
+    # Parsed once per file version; edits to the CSV invalidate the entry
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _load_statement(path, stat.st_mtime_ns, stat.st_size)
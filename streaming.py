@@ -0,0 +1,82 @@
+import json
+import re
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def clean_market_report(text):
+    market_report = re.sub(r"[\*\#\-]", "", text)
+    market_report = market_report.replace("\n", "\n\n")
+    return re.sub(r'\[\d+\]', '', market_report)
+
+
+def strip_think(text):
+    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+
+
+def _partial_suffix(text, token):
+    # Length of the longest suffix of text that could start token
+    for size in range(min(len(token) - 1, len(text)), 0, -1):
+        if text.endswith(token[:size]):
+            return size
+    return 0
+
+
+def _partial_citation(text):
+    match = re.search(r'\[\d*$', text)
+    return len(match.group(0)) if match else 0
+
+
+def sanitize_stream(chunks, market_report=False):
+    # Drops <think> spans (and the market report markup) from a stream of text
+    # chunks, holding back only the few characters that could start a tag
+    buffer = ""
+    thinking = False
+    for chunk in chunks:
+        buffer += chunk
+        output = []
+        while True:
+            if thinking:
+                end = buffer.find(THINK_CLOSE)
+                if end == -1:
+                    buffer = buffer[len(buffer) - _partial_suffix(buffer, THINK_CLOSE):]
+                    break
+                buffer = buffer[end + len(THINK_CLOSE):]
+                thinking = False
+            else:
+                start = buffer.find(THINK_OPEN)
+                if start == -1:
+                    keep = _partial_suffix(buffer, THINK_OPEN)
+                    if market_report:
+                        keep = max(keep, _partial_citation(buffer))
+                    output.append(buffer[:len(buffer) - keep])
+                    buffer = buffer[len(buffer) - keep:]
+                    break
+                output.append(buffer[:start])
+                buffer = buffer[start + len(THINK_OPEN):]
+                thinking = True
+        text = "".join(output)
+        if text:
+            yield clean_market_report(text) if market_report else text
+    if buffer and not thinking:
+        yield clean_market_report(buffer) if market_report else buffer
+
+
+def iter_sse_content(response):
+    # Content deltas from an OpenAI-compatible server-sent event stream
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        delta = json.loads(data)["choices"][0].get("delta", {})
+        if delta.get("content"):
+            yield delta["content"]
+
+
+def iter_groq_content(stream):
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
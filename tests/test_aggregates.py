@@ -0,0 +1,72 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregates import IndustryAggregate, load_group
+from financial_analysis import calculate_industry_averages
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def write_peers(directory):
+    # A 2024 peer, a peer moved back to 2023 and a peer with only Jan-Jul 2024
+    full = os.path.join(DATA_DIR, "synthetic_data_1.csv")
+    older = pd.read_csv(os.path.join(DATA_DIR, "synthetic_data_5.csv"))
+    older.columns = [column.replace("2024", "2023") for column in older.columns]
+    older_path = directory / "older.csv"
+    older.to_csv(older_path, index=False)
+    partial = pd.read_csv(os.path.join(DATA_DIR, "synthetic_data_6.csv"))
+    partial = partial[["Name", "Jan 2024", "Feb 2024", "Mar 2024", "Apr 2024", "May 2024", "Jun 2024", "Jul 2024"]]
+    partial_path = directory / "partial.csv"
+    partial.to_csv(partial_path, index=False)
+    return [full, str(older_path), str(partial_path)]
+
+
+def assert_same_averages(aggregate, peers):
+    expected = calculate_industry_averages(peers)
+    actual = aggregate.averages()
+    for name in ("quarterly_income", "metrics"):
+        assert list(actual[name].index) == list(expected[name].index)
+        np.testing.assert_allclose(
+            actual[name]["Industry Average"].to_numpy(dtype="float64"),
+            expected[name]["Industry Average"].to_numpy(dtype="float64"),
+            equal_nan=True,
+        )
+
+
+def test_add_matches_list_averages(tmp_path):
+    peers = write_peers(tmp_path)
+    aggregate = IndustryAggregate("group", tmp_path / "aggregates")
+    for count, path in enumerate(peers, 1):
+        aggregate.add(os.path.splitext(os.path.basename(path))[0], path)
+        assert_same_averages(aggregate, peers[:count])
+
+
+def test_remove_matches_remaining_peers(tmp_path):
+    peers = write_peers(tmp_path)
+    aggregate = load_group("group", peers, tmp_path / "aggregates")
+    aggregate.remove("older")
+    assert_same_averages(aggregate, [peers[0], peers[2]])
+    aggregate.remove("synthetic_data_1")
+    assert_same_averages(aggregate, [peers[2]])
+    aggregate.add("older", peers[1])
+    assert_same_averages(aggregate, [peers[2], peers[1]])
+
+
+def test_sync_and_reload_match_a_fresh_group(tmp_path):
+    peers = write_peers(tmp_path)
+    directory = tmp_path / "aggregates"
+    aggregate = load_group("changing", peers[::-1], directory)
+    aggregate.sync(peers[:1])
+    aggregate.sync(peers)
+    aggregate.save()
+    fresh = load_group("fresh", peers, directory)
+    reloaded = IndustryAggregate.load("changing", directory)
+    assert reloaded.periods == fresh.periods
+    np.testing.assert_allclose(reloaded.sums, fresh.sums)
+    np.testing.assert_array_equal(reloaded.counts, fresh.counts)
+    assert_same_averages(reloaded, peers)
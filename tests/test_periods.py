@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from periods import FiscalCalendar, Periods
+
+MONTHS_2024 = [f"{month} 2024" for month in ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")]
+
+
+def test_calendar_year_labels():
+    periods = Periods(MONTHS_2024, FiscalCalendar(1))
+    assert periods.quarters == ["Q1 2024", "Q2 2024", "Q3 2024", "Q4 2024"]
+    assert periods.years == ["2024"]
+    assert periods.window_label == "2024"
+
+
+def test_july_fiscal_year_is_named_after_its_end():
+    labels = [f"{month} 2023" for month in ("Jul", "Aug", "Sep", "Oct", "Nov", "Dec")] + MONTHS_2024[:6]
+    periods = Periods(labels, FiscalCalendar(7))
+    assert periods.quarters == ["Q1 FY2024", "Q2 FY2024", "Q3 FY2024", "Q4 FY2024"]
+    assert periods.years == ["FY2024"]
+    assert periods.window_label == "FY2024"
+
+
+def test_july_fiscal_year_on_calendar_months():
+    periods = Periods(MONTHS_2024, FiscalCalendar(7))
+    assert periods.quarters == ["Q3 FY2024", "Q4 FY2024", "Q1 FY2025", "Q2 FY2025"]
+    assert periods.years == []
+    assert periods.window_label == "TTM"
+
+
+def test_february_fiscal_year_drops_incomplete_quarters():
+    # Jan 2024 ends FY2024 and Nov-Dec 2024 only start the last quarter of FY2025
+    periods = Periods(MONTHS_2024, FiscalCalendar(2))
+    assert periods.quarters == ["Q1 FY2025", "Q2 FY2025", "Q3 FY2025"]
+    assert periods.years == []
+    assert periods.window_label == "TTM"
+
+
+def test_calendar_from_env(monkeypatch):
+    monkeypatch.setenv("FISCAL_YEAR_START", "Jul")
+    assert FiscalCalendar.from_env() == FiscalCalendar(7)
+    monkeypatch.setenv("FISCAL_YEAR_START", "2")
+    assert FiscalCalendar.from_env() == FiscalCalendar(2)
+    with pytest.raises(ValueError):
+        FiscalCalendar(13)
@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import clean_market_report, sanitize_stream, strip_think
+
+TEXT = "Intro <think>plan <b> the</think>Margin is 5% <thinking aside> and </think>done"
+REPORT = "# Sales rose [12] in Q2 - **costs** fell[3]\nNew line [x] kept"
+
+
+def splits(text):
+    # Every way to cut the text into three chunks
+    for first in range(len(text) + 1):
+        for second in range(first, len(text) + 1):
+            yield [text[:first], text[first:second], text[second:]]
+
+
+def test_think_spans_removed_at_every_chunk_boundary():
+    expected = strip_think(TEXT)
+    for chunks in splits(TEXT):
+        assert "".join(sanitize_stream(chunks)) == expected, chunks
+
+
+def test_citations_removed_at_every_chunk_boundary():
+    expected = clean_market_report(REPORT)
+    for chunks in splits(REPORT):
+        assert "".join(sanitize_stream(chunks, market_report=True)) == expected, chunks
+
+
+def test_single_characters():
+    assert "".join(sanitize_stream(iter(TEXT))) == strip_think(TEXT)
+    assert "".join(sanitize_stream(iter(REPORT), market_report=True)) == clean_market_report(REPORT)
+
+
+def test_only_a_possible_tag_start_is_held_back():
+    stream = sanitize_stream(["a < b <thi", "s is not a tag"])
+    assert next(stream) == "a < b "
+    assert "".join(stream) == "<this is not a tag"
+
+
+def test_unclosed_think_is_dropped():
+    assert "".join(sanitize_stream(["answer <think>still", " reasoning"])) == "answer "
@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verify import FOOTNOTE, parse_number, verify_tables
+
+EXPECTED = {
+    "company": {
+        "Quarterly Total Income Growth": 5.0,
+        "Gross Margin": 53.0,
+        "Total Expenses Ratio": 40.0,
+        "Net Profit Margin": -10.08,
+        "Total Cost Of Goods Sold % of Total Income": 47.0,
+    },
+    "industry": {
+        "Quarterly Total Income Growth": 4.0,
+        "Gross Margin": 50.0,
+        "Total Expenses Ratio": 42.0,
+        "Net Profit Margin": 3.0,
+        "Total Cost Of Goods Sold % of Total Income": 45.0,
+    },
+    "company_quarterly": {"Q1 2024": 1749489.0, "Q2 2024": 2016036.0},
+}
+
+AMOUNTS = """| Line | Q1 2024 | Q2 2024 |
+| --- | --- | --- |
+| Gross Profit | $927,229 | $1,068,499 |
+| Total Expenses | $700,000 | $806,414 |
+| Net Profit | -$176,343 | ($203,215) |
+| Total Cost Of Goods Sold | $822,260 | $947,537 |"""
+
+
+def test_dollar_rows_are_not_checked_as_ratios():
+    text, issues = verify_tables(AMOUNTS, EXPECTED)
+    assert issues == []
+    assert text == AMOUNTS
+    assert FOOTNOTE not in text
+
+
+def test_percent_rows_with_amount_labels_are_still_checked():
+    table = "| Metric | Company | Industry |\n| --- | --- | --- |\n| Gross Profit | 48.00% | 50.00% |"
+    text, issues = verify_tables(table, EXPECTED)
+    assert [issue["expected"] for issue in issues] == [53.0]
+    assert "| Gross Profit | 53.00%* | 50.00% |" in text
+
+
+def test_bracketed_percentage_is_negative():
+    value, span, fmt = parse_number("(10.08%)")
+    assert value == -10.08
+    assert span == (0, 8)
+    assert fmt["percent"]
+
+    table = (
+        "| Metric | Company | Industry Average | Verdict |\n| --- | --- | --- | --- |\n"
+        "| Net Profit Margin | (10.08%) | 3.00% | Underperforming |"
+    )
+    text, issues = verify_tables(table, EXPECTED)
+    assert issues == []
+    assert text == table
+
+
+def test_wrong_bracketed_percentage_is_replaced_whole():
+    table = "| Metric | Company |\n| --- | --- |\n| Net Profit Margin | (12.50%) |"
+    text, issues = verify_tables(table, EXPECTED)
+    assert len(issues) == 1
+    assert "| Net Profit Margin | -10.08%* |" in text
@@ -0,0 +1,217 @@
+import re
+
+from instrumentation import record, stage
+
+# Metrics the analysis tables report, matched to table rows by keyword
+GROWTH = "Quarterly Total Income Growth"
+GROSS_MARGIN = "Gross Margin"
+EXPENSES_RATIO = "Total Expenses Ratio"
+NET_MARGIN = "Net Profit Margin"
+COGS_RATIO = "Total Cost Of Goods Sold % of Total Income"
+# For cost ratios a lower value than the industry is the better result
+HIGHER_IS_BETTER = {GROWTH: True, GROSS_MARGIN: True, EXPENSES_RATIO: False, NET_MARGIN: True, COGS_RATIO: False}
+# Differences within this many percentage points count as "On par"
+ON_PAR_POINTS = 1.0
+
+SEPARATOR = re.compile(r"^:?-{3,}:?$")
+NUMBER = re.compile(r"(?P<sign>-)?\(?\s*(?P<dollar>\$)?\s*(?P<inner>-)?(?P<digits>\d[\d,]*(?:\.\d+)?|\.\d+)\s*(?P<scale>[kKmMbB](?![a-zA-Z]))?\)?\s*(?P<percent>%)?")
+QUARTER = re.compile(r"\bQ([1-4])\b(?:\D*(\d{4}))?")
+VERDICT = re.compile(r"outperform\w*|on par|underperform\w*", re.IGNORECASE)
+# Row labels that name a ratio rather than an amount, e.g. "Gross Margin" but not "Gross Profit"
+RATIO_LABEL = re.compile(r"margin|ratio|%|percent|growth", re.IGNORECASE)
+SCALES = {"k": 1e3, "m": 1e6, "b": 1e9}
+FOOTNOTE = "_Figures marked * were corrected against the statement data._"
+
+
+def metric_for(label):
+    # Canonical metric name for a table row label, or None
+    text = re.sub(r"[^a-z%]+", " ", label.lower())
+    if "growth" in text:
+        return GROWTH
+    if "cost of goods" in text or "cogs" in text:
+        return COGS_RATIO
+    if "gross" in text:
+        return GROSS_MARGIN
+    if "net" in text and ("margin" in text or "profit" in text):
+        return NET_MARGIN
+    if "expense" in text:
+        return EXPENSES_RATIO
+    return None
+
+
+def column_role(header, default):
+    text = header.lower()
+    if "verdict" in text or "assessment" in text or "status" in text:
+        return "verdict"
+    if "industry" in text or "peer" in text or "benchmark" in text:
+        return "industry"
+    if "difference" in text or "gap" in text or "variance" in text or "formula" in text or "calculation" in text:
+        return None
+    return default
+
+
+def parse_number(cell):
+    # (value, span, format) for the reported figure in a cell, or None
+    start = cell.rindex("=") + 1 if "=" in cell else 0
+    match = NUMBER.search(cell, start)
+    if match is None:
+        return None
+    digits = match.group("digits")
+    value = float(digits.replace(",", ""))
+    scale = SCALES[match.group("scale").lower()] if match.group("scale") else 1.0
+    text = match.group(0)
+    # Accounting style (1,234) or (10.08%) is negative; the bracket may close after the %
+    trailing = cell[match.end():]
+    inside = text.rstrip().endswith(")") or text.rstrip().rstrip("%").rstrip().endswith(")")
+    bracketed = text.lstrip().startswith("(") and (inside or trailing.lstrip().startswith(")"))
+    if match.group("sign") or match.group("inner") or bracketed:
+        value = -value
+    decimals = len(digits.split(".")[1]) if "." in digits else 0
+    if bracketed:
+        # The brackets are part of the figure, so a correction replaces them too
+        stop = match.end() - len(text) + len(text.rstrip()) if inside else match.end() + trailing.index(")") + 1
+        span = (match.start() + len(text) - len(text.lstrip()), stop)
+    else:
+        parts = [name for name in ("sign", "dollar", "inner", "digits", "scale", "percent") if match.group(name)]
+        span = (match.start(parts[0]), match.end(parts[-1]))
+    return value * scale, span, {
+        "decimals": decimals, "scale": scale, "dollar": bool(match.group("dollar")), "percent": bool(match.group("percent")),
+    }
+
+
+def agrees(reported, expected, fmt):
+    # Equal up to the rounding the table used; percentages get at least 0.01 points
+    tolerance = 0.5 * 10 ** -fmt["decimals"] * fmt["scale"]
+    if fmt["percent"]:
+        tolerance = max(tolerance, 0.01)
+    return abs(reported - expected) <= tolerance + 1e-9 * abs(expected)
+
+
+def format_like(value, fmt):
+    decimals = max(fmt["decimals"], 2) if fmt["percent"] or fmt["scale"] != 1.0 else fmt["decimals"]
+    suffix = {1e3: "K", 1e6: "M", 1e9: "B"}.get(fmt["scale"], "")
+    number = f"{abs(value) / fmt['scale']:,.{decimals}f}{suffix}"
+    if fmt["dollar"]:
+        number = "$" + number
+    if value < 0:
+        number = "-" + number
+    return number + ("%" if fmt["percent"] else "")
+
+
+def expected_verdict(metric, company, industry):
+    difference = company - industry
+    if abs(difference) <= ON_PAR_POINTS:
+        return "On par"
+    return "Outperforming" if (difference > 0) == HIGHER_IS_BETTER[metric] else "Underperforming"
+
+
+def split_row(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def join_row(line, cells):
+    indent = line[:len(line) - len(line.lstrip())]
+    return indent + "| " + " | ".join(cells) + " |"
+
+
+def iter_tables(lines):
+    # (header index, first row index, end index) for each markdown table
+    i = 0
+    while i < len(lines) - 1:
+        if lines[i].lstrip().startswith("|") and lines[i + 1].lstrip().startswith("|"):
+            separator = split_row(lines[i + 1])
+            if separator and all(SEPARATOR.match(cell.replace(" ", "")) for cell in separator):
+                end = i + 2
+                while end < len(lines) and lines[end].lstrip().startswith("|"):
+                    end += 1
+                yield i, i + 2, end
+                i = end
+                continue
+        i += 1
+
+
+def lookup(expected, side, label):
+    # Expected figure for a row: a metric, or quarterly income for a quarter label
+    metric = metric_for(label)
+    if metric is not None:
+        return metric, expected.get(side, {}).get(metric)
+    quarter = QUARTER.search(label)
+    if quarter is None:
+        return None, None
+    # Labels may be "Q1 2024" or "Q1 FY2025"; a label without a year must be unambiguous
+    number, year = quarter.groups()
+    matches = []
+    for key, value in expected.get(f"{side}_quarterly", {}).items():
+        key_number, key_year = QUARTER.search(key).groups()
+        if key_number == number and year in (None, key_year):
+            matches.append(value)
+    return None, matches[0] if len(matches) == 1 else None
+
+
+def verify_tables(text, expected, default_side="company", patch=True):
+    # Checks every figure in the markdown tables of text against expected, which maps
+    # "company"/"industry" to {metric: value} and "company_quarterly"/"industry_quarterly"
+    # to {"Q1 2024": income}. Returns (text, issues); mismatches are corrected when
+    # patch is set and annotated with the expected value otherwise.
+    with stage("verify"):
+        lines = text.split("\n")
+        issues = []
+        for header_index, first_row, end in iter_tables(lines):
+            header = split_row(lines[header_index])
+            roles = [None] + [column_role(cell, default_side) for cell in header[1:]]
+            for index in range(first_row, end):
+                cells = split_row(lines[index])
+                if not cells:
+                    continue
+                values = {}
+                metric = None
+                changed = False
+                # Amount rows such as "Gross Profit | $927,229" share keywords with the ratios
+                # and are only checked as ratios when they are written as percentages
+                parsed_cells = [parse_number(cell) for cell in cells]
+                ratio_label = bool(RATIO_LABEL.search(cells[0]))
+                ratio_row = ratio_label or any(
+                    parsed is not None and parsed[2]["percent"] for parsed in parsed_cells[1:len(roles)]
+                )
+                for column, cell in enumerate(cells[1:len(roles)], start=1):
+                    role = roles[column]
+                    if role not in ("company", "industry"):
+                        continue
+                    metric, value = lookup(expected, role, cells[0])
+                    if metric is not None and not ratio_row:
+                        metric = value = None
+                    values[role] = value
+                    parsed = parsed_cells[column]
+                    if value is None or parsed is None:
+                        continue
+                    reported, (start, stop), fmt = parsed
+                    if metric is not None and (fmt["dollar"] or not (fmt["percent"] or ratio_label)):
+                        continue
+                    if agrees(reported, value, fmt):
+                        continue
+                    correct = format_like(value, fmt)
+                    issues.append({"row": cells[0], "column": header[column], "reported": reported, "expected": value})
+                    if patch:
+                        cells[column] = cell[:start] + correct + "*" + cell[stop:]
+                    else:
+                        cells[column] = f"{cell} (expected {correct})"
+                    changed = True
+                if metric is not None and values.get("company") is not None and values.get("industry") is not None:
+                    verdict = expected_verdict(metric, values["company"], values["industry"])
+                    for column, role in enumerate(roles[:len(cells)]):
+                        match = VERDICT.search(cells[column]) if role == "verdict" else None
+                        if match is None or match.group(0).lower().startswith(verdict.lower()[:6]):
+                            continue
+                        issues.append({"row": cells[0], "column": header[column], "reported": match.group(0), "expected": verdict})
+                        if patch:
+                            cells[column] = cells[column][:match.start()] + verdict + "*" + cells[column][match.end():]
+                        else:
+                            cells[column] = f"{cells[column]} (expected {verdict})"
+                        changed = True
+                if changed:
+                    lines[index] = join_row(lines[index], cells)
+        record(mismatches=len(issues))
+        text = "\n".join(lines)
+        if issues and patch:
+            text = f"{text.rstrip()}\n\n{FOOTNOTE}"
+        return text, issues